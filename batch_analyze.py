@@ -0,0 +1,144 @@
+"""
+Runs onsetdetect.analyze_audio over many recordings with a process pool.
+
+Results go to one JSON Lines file, one record per recording:
+    {"file": ..., "duration_s": ..., "elapsed_s": ..., "onsets": [...], "note_segments": [[start, end], ...]}
+Failed files get an "error" record instead. A restarted run skips every file
+that already has a successful record in the output, so an interrupted
+nightly batch picks up where it stopped. Files are matched by their real
+path, so ./a.wav, a.wav and /abs/a.wav are one file; records store it.
+
+    python batch_analyze.py recordings/ -o results.jsonl --workers 8
+    python batch_analyze.py manifest.txt -o results.jsonl --cache-dir ~/.cache/violai
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.mp3', '.m4a', '.aiff', '.aif')
+
+
+def collect_inputs(source, extensions=AUDIO_EXTENSIONS):
+    """Audio files under a directory (recursive), or the paths listed in a manifest file."""
+    if os.path.isdir(source):
+        files = []
+        for root, _, names in os.walk(source):
+            files.extend(os.path.join(root, name) for name in names
+                         if name.lower().endswith(extensions))
+        return sorted(files)
+
+    # manifest: one path per line, relative paths are relative to the manifest
+    base = os.path.dirname(os.path.abspath(source))
+    files = []
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                files.append(os.path.normpath(os.path.join(base, line)))
+    return files
+
+
+def load_finished(output_path):
+    """
+    Real paths of the files that already have a successful record in the
+    output. A partial last line left by a crash is cut off so new records
+    start on a clean line.
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            print(f"Dropping partial record at the end of {output_path}")
+            f.truncate(complete)
+    for line in data[:complete].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if 'error' not in record:
+            finished.add(os.path.realpath(record['file']))
+    return finished
+
+
+def analyze_file(file_path, cache_dir=None):
+    # imported in the worker so the parent process never loads librosa
+    from onsetdetect import analyze_features, load_features
+    from feature_cache import FeatureCache
+
+    cache = FeatureCache(cache_dir) if cache_dir else None
+    start = time.perf_counter()
+    try:
+        features = load_features(file_path, cache=cache)
+        _, _, green_onsets, note_segments = analyze_features(features)
+        record = {
+            'file': file_path,
+            'duration_s': float(features['duration']),  # from the decoded samples, no second decode
+            'onsets': [float(t) for t in green_onsets],
+            'note_segments': [[float(s), float(e)] for s, e in note_segments],
+        }
+    except Exception as e:
+        record = {'file': file_path, 'error': f"{type(e).__name__}: {e}"}
+    record['elapsed_s'] = time.perf_counter() - start
+    return record
+
+
+def run_batch(files, output_path, workers=None, cache_dir=None):
+    finished = load_finished(output_path)
+    # dict keeps the input order and drops repeats of the same file
+    files = list(dict.fromkeys(os.path.realpath(f) for f in files))
+    pending = [f for f in files if f not in finished]
+    print(f"{len(files)} files, {len(files) - len(pending)} already done, {len(pending)} to analyze")
+    if not pending:
+        return
+
+    audio_seconds = 0.0
+    n_ok = n_failed = 0
+    start = time.perf_counter()
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_file, f, cache_dir): f for f in pending}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                # the worker itself died (killed, out of memory, unpicklable result):
+                # record it like any failed file and keep going
+                record = {'file': futures[future], 'error': f"{type(e).__name__}: {e}", 'elapsed_s': 0.0}
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            os.fsync(out.fileno())  # a finished file is never lost to a crash
+
+            done = n_ok + n_failed + 1
+            if 'error' in record:
+                n_failed += 1
+                print(f"[{done}/{len(pending)}] FAILED {record['file']}: {record['error']}")
+            else:
+                n_ok += 1
+                audio_seconds += record['duration_s']
+                print(f"[{done}/{len(pending)}] {record['file']}: {len(record['onsets'])} onsets, "
+                      f"{record['elapsed_s']:.1f}s for {record['duration_s']:.1f}s of audio")
+
+    wall = time.perf_counter() - start
+    print(f"Done: {n_ok} ok, {n_failed} failed in {wall:.1f}s "
+          f"({(n_ok + n_failed) / wall:.2f} files/s, {audio_seconds / wall:.1f}x realtime)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch onset analysis of recordings.")
+    parser.add_argument('source', help="directory of recordings or manifest file (one path per line)")
+    parser.add_argument('-o', '--output', default='onsets.jsonl', help="JSON Lines output file")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: all cores)")
+    parser.add_argument('--cache-dir', default=None, help="FeatureCache directory to reuse features")
+    args = parser.parse_args()
+
+    run_batch(collect_inputs(args.source), args.output, args.workers, args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Benchmark of the onset-fusion stage of onsetdetect.analyze_audio.
+
+Runs the original per-frame Python loops (kept here as the reference) and the
+vectorized onsetdetect.fuse_onsets on synthetic feature tracks, checks that
+green_onsets and note_segments are identical and prints the speedup. Before
+timing, both fuse_onsets and StreamingOnsetFusion are checked against the
+loops over a range of onset_window values, including ones at or below the
+0.1 s gap of the final green-onset filter.
+
+    python bench_onset_fusion.py --minutes 1 5 15
+"""
+import argparse
+import time
+
+import numpy as np
+
+from onsetdetect import StreamingOnsetFusion, fuse_onsets, hz_to_midi_safe
+
+
+def fuse_onsets_loop(times, f0, onset_times_librosa, frame_times, rms, duration, onset_window=0.15):
+    """The original loop implementation from analyze_audio, verbatim apart from the onset_window argument."""
+    # === Energy onset by RMS diff ===
+    rms_diff = np.append(np.diff(rms), 0)
+    threshold = np.percentile(rms_diff[rms_diff > 0], 84)
+    energy_onset_indices = np.where(rms_diff > threshold)[0]
+    energy_onset_times = frame_times[energy_onset_indices]
+
+    # === Pitch onset ===
+    f0_filled = []
+    midi_filled = []
+    for pitch in f0:
+        if pitch is None or pitch < 350:
+            f0_filled.append(0)
+            midi_filled.append(None)
+        else:
+            f0_filled.append(pitch)
+            midi_filled.append(hz_to_midi_safe(pitch))
+
+    pitch_onset_times = []
+    pitch_diff_threshold_midi = 0.5
+    time_window = 0.1
+    min_interval = 0.15
+    last_onset_time = -np.inf
+
+    for i, (t_i, m_i) in enumerate(zip(times, midi_filled)):
+        if m_i is None or t_i - last_onset_time < min_interval:
+            continue
+        for j in range(i - 1, -1, -1):
+            if times[j] < t_i - time_window:
+                break
+            m_j = midi_filled[j]
+            if m_j is None:
+                continue
+            if abs(m_i - m_j) > pitch_diff_threshold_midi:
+                pitch_onset_times.append(t_i)
+                last_onset_time = t_i
+                break
+
+    # === Combine onsets ===
+    combined_onsets = np.concatenate([onset_times_librosa, energy_onset_times, pitch_onset_times])
+    combined_onsets = np.sort(combined_onsets)
+
+    # === Filter by RMS threshold and variation ===
+    min_rms_threshold = 0.0001
+    min_rms_variation = 0.05
+    valid_onsets = set(pitch_onset_times)
+
+    for t in combined_onsets:
+        if any(abs(t - p) < 0.01 for p in pitch_onset_times):
+            continue
+        idx = np.argmin(np.abs(frame_times - t))
+        if idx >= len(rms) or rms[idx] < min_rms_threshold:
+            continue
+        mask = (frame_times >= t) & (frame_times <= t + 0.2)
+        if np.sum(mask) < 2:
+            continue
+        segment = rms[mask]
+        if np.max(segment) - np.min(segment) < min_rms_variation:
+            continue
+        valid_onsets.add(t)
+
+    combined_onsets = np.array(sorted(valid_onsets))
+
+    # === Remove duplicate (green / purple onset classification) ===
+    final_green_onsets = []
+    purple_onsets = []
+    all_custom_onsets = sorted(set(np.round(pitch_onset_times, 3)) |
+                               set(np.round(energy_onset_times, 3)))
+
+    for t in all_custom_onsets:
+        if any(abs(t - prev_t) < onset_window for prev_t in final_green_onsets + purple_onsets):
+            purple_onsets.append(t)
+        else:
+            final_green_onsets.append(t)
+
+    green_onsets = []
+    for t in final_green_onsets + purple_onsets:
+        if len(green_onsets) == 0 or t - green_onsets[-1] > 0.1 or \
+           any(abs(t - p) < 0.01 for p in pitch_onset_times):
+            green_onsets.append(t)
+
+    # === note_end ===
+    note_segments = []
+    for i, onset in enumerate(green_onsets):
+        next_onset = green_onsets[i + 1] if i + 1 < len(green_onsets) else duration
+        frame_mask = (frame_times >= onset) & (frame_times <= next_onset)
+        end_time = next_onset  # next onset
+        for t, r in zip(frame_times[frame_mask], rms[frame_mask]):
+            if r < 0.01:
+                end_time = t
+                break
+        note_segments.append((onset, end_time))
+
+    return green_onsets, note_segments
+
+
+def synthetic_features(duration, sr=44100, hop_length=512, seed=0):
+    """
+    Feature tracks shaped like those of a violin take: notes of random length
+    with vibrato and pitch noise, unvoiced gaps, a decaying RMS envelope and
+    librosa-like onsets near each note start.
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = int(duration * sr / hop_length) + 1
+    times = np.arange(n_frames) * hop_length / sr
+
+    f0 = np.full(n_frames, np.nan)
+    rms = np.abs(rng.normal(0, 0.002, n_frames))
+    onsets = []
+    t = 0.2
+    while t < duration:
+        length = rng.uniform(0.12, 0.9)
+        start, stop = np.searchsorted(times, [t, min(t + length, duration)])
+        midi = rng.integers(65, 96)
+        local = times[start:stop] - t
+        vibrato = 0.3 * np.sin(2 * np.pi * 5.5 * local) * (local > 0.15)
+        f0[start:stop] = 440.0 * 2 ** ((midi - 69 + vibrato + rng.normal(0, 0.05, stop - start)) / 12)
+        rms[start:stop] += rng.uniform(0.05, 0.3) * np.exp(-local * rng.uniform(0.5, 4))
+        onsets.append(t + rng.normal(0, 0.01))
+        t += length + (rng.uniform(0.05, 0.4) if rng.random() < 0.3 else 0)
+    return times, f0, np.array(onsets), times.copy(), rms, duration
+
+
+def fuse_onsets_streaming(times, f0, onset_times_librosa, frame_times, rms, duration, onset_window=0.15,
+                          block=37):
+    """StreamingOnsetFusion over `block`-frame pushes, in fuse_onsets' output format."""
+    rms_diff = np.append(np.diff(rms), 0)
+    fusion = StreamingOnsetFusion(onset_window=onset_window,
+                                  energy_threshold=np.percentile(rms_diff[rms_diff > 0], 84))
+    events = []
+    for start in range(0, len(times), block):
+        events += fusion.push(times[start:start + block], f0[start:start + block], rms[start:start + block])
+    events += fusion.finish(duration)
+    onsets = [e[1] for e in events if e[0] == 'onset']
+    ends = {e[1]: e[2] for e in events if e[0] == 'note'}
+    return onsets, [(t, ends[t]) for t in onsets]
+
+
+def check_onset_windows(windows, minutes=2.0):
+    """Raises SystemExit if fuse_onsets or StreamingOnsetFusion differ from the loops at any onset_window."""
+    features = synthetic_features(minutes * 60, seed=1)
+    for onset_window in windows:
+        expected = fuse_onsets_loop(*features, onset_window=onset_window)
+        result = fuse_onsets(*features, onset_window=onset_window)
+        if result[0] != expected[0] or result[1] != expected[1]:
+            raise SystemExit(f"Mismatch at onset_window={onset_window}: "
+                             f"fuse_onsets has {len(result[0])} onsets, the loops {len(expected[0])}")
+        streamed = fuse_onsets_streaming(*features, onset_window=onset_window)
+        if sorted(streamed[0]) != sorted(expected[0]) or sorted(streamed[1]) != sorted(expected[1]):
+            raise SystemExit(f"Mismatch at onset_window={onset_window}: "
+                             f"StreamingOnsetFusion has {len(streamed[0])} onsets, the loops {len(expected[0])}")
+        print(f"onset_window {onset_window:g}: {len(expected[0])} onsets, batch and streaming match")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 15])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--onset-windows', type=float, nargs='+', default=[0.05, 0.08, 0.1, 0.12, 0.15, 0.3])
+    args = parser.parse_args()
+
+    check_onset_windows(args.onset_windows)
+    print(f"{'minutes':>8} {'frames':>8} {'onsets':>7} {'loop (s)':>10} {'vector (s)':>11} {'speedup':>8}")
+    for minutes in args.minutes:
+        features = synthetic_features(minutes * 60)
+
+        start = time.perf_counter()
+        expected = fuse_onsets_loop(*features)
+        loop_time = time.perf_counter() - start
+
+        vector_time = np.inf
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = fuse_onsets(*features)
+            vector_time = min(vector_time, time.perf_counter() - start)
+
+        if result[0] != expected[0] or result[1] != expected[1]:
+            raise SystemExit(f"Mismatch at {minutes} min: vectorized fusion differs from the loops")
+        print(f"{minutes:>8g} {len(features[0]):>8} {len(result[0]):>7} "
+              f"{loop_time:>10.3f} {vector_time:>11.4f} {loop_time / vector_time:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
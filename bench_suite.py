@@ -0,0 +1,389 @@
+"""
+Synthetic-signal benchmark and accuracy suite for the analysis paths.
+
+Renders violin-like takes from a score (harmonic tones with known onsets,
+vibrato, noise, tempo changes) and runs them headless through:
+
+    offline   onsetdetect.analyze_audio (pyin + onset fusion) on a wav file
+    yin-live  a DetectionSession set up like detection.py: block-wise
+              band-pass, StreamingYin every 10 ms hop, fixed-lag smoothing
+    crepe     a DetectionSession set up like realtime_detect.py: 50 ms frames
+              at 16 kHz batched through crepe (skipped if crepe is missing)
+
+The live paths run the shipped session itself, fed by an ArraySource, and
+are scored on the events it emits. Each run reports throughput (x realtime),
+per-batch compute latency (p50/p95/p99) plus the algorithmic delay, onset
+precision/recall/F-measure (50 ms tolerance), pitch accuracy (within 50
+cents of the true f0, vibrato included) and, for the live paths, the share
+of notes the session judged correct. Results go to a JSON file and are
+appended to a CSV history, so runs from different releases line up;
+--compare flags metrics that regressed against an earlier JSON.
+
+    python bench_suite.py --seconds 30 --paths offline yin-live
+    python bench_suite.py --score Four_Seasons_Spring_I_Violin.mxl --compare bench_results/last.json
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+from onsetdetect import analyze_audio
+
+# the live-detection modules are shared with the Qt detectors in violAI-rhythm-baseline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "violAI-rhythm-baseline"))
+from capture import ArraySource
+from latency import LatencyHistogram
+from pitch_estimators import make_estimator
+from pitch_smoother import hz_to_midi
+from score_timeline import ScoreTimeline
+from session import DetectionSession, QueueSink
+
+PATHS = ('offline', 'yin-live', 'crepe')
+# name -> synthesis settings; every scenario renders the same notes
+SCENARIOS = {
+    'clean':   {'vibrato_cents': 0.0, 'snr_db': None, 'tempo_ramp': 1.0},
+    'vibrato': {'vibrato_cents': 30.0, 'snr_db': None, 'tempo_ramp': 1.0},
+    'noisy':   {'vibrato_cents': 30.0, 'snr_db': 20.0, 'tempo_ramp': 1.0},
+    'tempo':   {'vibrato_cents': 30.0, 'snr_db': 30.0, 'tempo_ramp': 1.5},
+}
+ONSET_TOLERANCE = 0.05  # seconds
+PITCH_TOLERANCE = 0.5  # semitones
+EDGE_GUARD = 0.03  # seconds around note boundaries left out of pitch accuracy
+# metric -> +1 if higher is better, -1 if lower is better, for --compare
+TRACKED_METRICS = {'x_realtime': 1, 'onset_f': 1, 'pitch_accuracy': 1, 'note_accuracy': 1, 'latency_p95_ms': -1}
+
+
+# === Test material ===
+
+def random_score(seconds, bpm=100, seed=0):
+    """A random monophonic line in G3..A6 as (beat, beats, midi) tuples, about `seconds` long at bpm."""
+    rng = np.random.default_rng(seed)
+    notes = []
+    beat = 0.0
+    midi = 69
+    while beat * 60.0 / bpm < seconds:
+        length = rng.choice([0.5, 1.0, 1.0, 1.5, 2.0])
+        midi = int(np.clip(midi + rng.integers(-5, 6), 55, 93))
+        notes.append((beat, length, midi))
+        beat += length + (0.5 if rng.random() < 0.15 else 0.0)  # an occasional rest
+    return notes, bpm
+
+
+def score_notes(path):
+    """(beat, beats, midi) of every note in a score file (top note of chords) and its first tempo."""
+    from score_compiler import load_score
+    score = load_score(path, default_bpm=60)
+    rows = score.top_rows()
+    rows = rows[(score.chord_size[rows] > 0) & (score.end_beats[rows] > score.start_beats[rows])]
+    notes = [(float(score.start_beats[i]), float(score.end_beats[i] - score.start_beats[i]), int(score.midi[i]))
+             for i in rows]
+    return notes, score.bpm
+
+
+def beat_clock(bpm, tempo_ramp, total_beats):
+    """
+    Maps beats to seconds with the tempo moving linearly from bpm to
+    bpm * tempo_ramp over the piece.
+    """
+    grid = np.linspace(0, max(total_beats, 1e-9), 4096)
+    seconds = np.concatenate([[0], np.cumsum(np.diff(grid) * 60.0 / (bpm * (1 + (tempo_ramp - 1) * grid[1:] / grid[-1])))])
+    return lambda beats: np.interp(beats, grid, seconds)
+
+
+def synthesize(notes, bpm, sr=44100, vibrato_cents=30.0, snr_db=None, tempo_ramp=1.0,
+               articulation=0.9, seed=0):
+    """
+    Renders a score as a bowed-string-like signal.
+
+    Each note is a harmonic tone (1/k^1.5 partials up to 0.45 sr) with a
+    25 ms attack, 40 ms release and a 5.5 Hz vibrato that fades in after
+    150 ms. Notes sound for `articulation` of their length.
+
+    Returns:
+        tuple: (y, truth) with truth a dict: 'onsets' (s), 'notes' as
+            (start, end, midi) and 'f0' a function of time (Hz, NaN between notes).
+    """
+    rng = np.random.default_rng(seed)
+    clock = beat_clock(bpm, tempo_ramp, max(beat + length for beat, length, _ in notes))
+    events = [(float(clock(beat)), float(clock(beat + length * articulation)), midi)
+              for beat, length, midi in notes]
+    y = np.zeros(int((events[-1][1] + 0.5) * sr))
+
+    def vibrato(local):
+        depth = vibrato_cents / 100.0 * np.clip((local - 0.15) / 0.1, 0, 1)
+        return depth * np.sin(2 * np.pi * 5.5 * local)
+
+    for start, end, midi in events:
+        n = int((end - start) * sr)
+        local = np.arange(n) / sr
+        f0 = 440.0 * 2 ** ((midi - 69 + vibrato(local)) / 12)
+        phase = 2 * np.pi * np.cumsum(f0) / sr
+        tone = sum(np.sin(k * phase) / k ** 1.5 for k in range(1, int(0.45 * sr / f0.max()) + 1))
+        envelope = np.minimum(1, np.minimum(local / 0.025, (local[-1] - local) / 0.04))
+        first = int(start * sr)
+        y[first:first + n] += 0.3 * envelope * tone / np.max(np.abs(tone))
+    if snr_db is not None:
+        noise = rng.normal(0, 1, len(y))
+        y += noise * np.sqrt(np.mean(y ** 2) / 10 ** (snr_db / 10))
+
+    starts = np.array([e[0] for e in events])
+    ends = np.array([e[1] for e in events])
+    midis = np.array([e[2] for e in events], dtype=float)
+
+    def truth_f0(t):
+        t = np.asarray(t, dtype=float)
+        i = np.searchsorted(starts, t, side='right') - 1
+        inside = (i >= 0) & (t < ends[np.maximum(i, 0)])
+        local = t - starts[np.maximum(i, 0)]
+        return np.where(inside, 440.0 * 2 ** ((midis[np.maximum(i, 0)] - 69 + vibrato(local)) / 12), np.nan)
+
+    return y.astype(np.float32), {'onsets': starts, 'notes': events, 'f0': truth_f0}
+
+
+# === Metrics ===
+
+def onset_scores(detected, reference, tolerance=ONSET_TOLERANCE):
+    """Precision, recall and F-measure with one-to-one matching within `tolerance`."""
+    detected = np.sort(np.asarray(detected, dtype=float))
+    reference = np.sort(np.asarray(reference, dtype=float))
+    used = np.zeros(len(reference), dtype=bool)
+    hits = 0
+    for t in detected:
+        candidates = np.where(~used & (np.abs(reference - t) <= tolerance))[0]
+        if len(candidates):
+            used[candidates[np.argmin(np.abs(reference[candidates] - t))]] = True
+            hits += 1
+    precision = hits / len(detected) if len(detected) else 0.0
+    recall = hits / len(reference) if len(reference) else 0.0
+    f = 2 * precision * recall / (precision + recall) if hits else 0.0
+    return {'onset_precision': round(precision, 4), 'onset_recall': round(recall, 4), 'onset_f': round(f, 4)}
+
+
+def pitch_accuracy(times, f0, truth):
+    """Share of the truly voiced frames (away from note edges) estimated within PITCH_TOLERANCE."""
+    times = np.asarray(times, dtype=float)
+    reference = truth['f0'](times)
+    guarded = truth['f0'](times - EDGE_GUARD) * truth['f0'](times + EDGE_GUARD)
+    scored = np.isfinite(reference) & np.isfinite(guarded)
+    error = np.abs(hz_to_midi(np.asarray(f0, dtype=float)[scored]) - hz_to_midi(reference[scored]))
+    correct = np.isfinite(error) & (error <= PITCH_TOLERANCE)
+    return round(float(correct.mean()), 4) if scored.any() else 0.0
+
+
+def pitch_track_onsets(times, f0, min_frames=3):
+    """
+    Note starts of a live pitch track: a frame where the rounded MIDI note
+    changes (or sound starts) and holds for min_frames frames, which is how
+    the live detectors see a new note.
+    """
+    notes = np.round(hz_to_midi(f0))
+    onsets = []
+    current = np.nan
+    for i in range(len(notes) - min_frames + 1):
+        candidate = notes[i]
+        if np.isnan(candidate):
+            if np.all(np.isnan(notes[i:i + min_frames])):
+                current = np.nan
+            continue
+        if candidate != current and np.all(notes[i:i + min_frames] == candidate):
+            onsets.append(times[i])
+            current = candidate
+    return onsets
+
+
+def latency_fields(histogram, delay_s):
+    summary = histogram.summary()
+    return {'latency_p50_ms': summary['p50_ms'], 'latency_p95_ms': summary['p95_ms'],
+            'latency_p99_ms': summary['p99_ms'], 'algorithmic_delay_ms': round(1e3 * delay_s, 1)}
+
+
+# === Paths under test ===
+
+class _KeepFeatures:
+    """Cache stand-in for analyze_audio that computes every time and keeps the features."""
+
+    def get_or_compute(self, file_path, version, params, compute):
+        self.features = compute(file_path, params)
+        return self.features
+
+
+def run_offline(y, sr, truth):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'take.wav')
+        sf.write(path, y, sr)
+        keep = _KeepFeatures()
+        start = time.perf_counter()
+        _, frame_times, green_onsets, _ = analyze_audio(path, cache=keep)
+        elapsed = time.perf_counter() - start
+    histogram = LatencyHistogram()
+    histogram.record(elapsed)  # one call; offline latency is the whole-file turnaround
+    result = {'x_realtime': round(len(y) / sr / elapsed, 2)}
+    result.update(latency_fields(histogram, 0.0))
+    result.update(onset_scores(green_onsets, truth['onsets']))
+    result['pitch_accuracy'] = pitch_accuracy(frame_times, keep.features['f0'], truth)
+    return result
+
+
+def run_session(y, sr, truth, blocksize=1024, min_onset_frames=3, **settings):
+    """
+    Plays the take through a DetectionSession as fast as it is consumed and
+    scores its 'pitch' and 'note' events. The ring holds the whole take and no
+    hop is skipped (max_lag_s=None), so the result doesn't depend on how the
+    threads get scheduled.
+    """
+    source = ArraySource(y, sr, blocksize, speed=None)
+    timeline = ScoreTimeline([e[0] for e in truth['notes']], [e[1] for e in truth['notes']],
+                             [e[2] for e in truth['notes']], [f"n{i}" for i in range(len(truth['notes']))])
+    sink = QueueSink()
+    session = DetectionSession(source, timeline, sinks=[sink], samplerate=sr, max_lag_s=None,
+                               buffer_seconds=len(y) / sr + 1.0, **settings)
+    start = time.perf_counter()
+    session.start()
+    source.finished.wait()
+    while session.reader.backlog() > 0:
+        time.sleep(0.001)
+    session.stop()
+    elapsed = time.perf_counter() - start
+
+    events = sink.drain()
+    pitches = [e for e in events if e['type'] == 'pitch']
+    times = [e['time'] for e in pitches]
+    f0 = [e['pitch_hz'] for e in pitches]
+    notes = [e for e in events if e['type'] == 'note']
+    result = {'x_realtime': round(len(y) / sr / elapsed, 2)}
+    result.update(latency_fields(session.latency.stages.get('pitch', LatencyHistogram()), session.delay))
+    result.update(onset_scores(pitch_track_onsets(times, f0, min_frames=min_onset_frames), truth['onsets']))
+    result['pitch_accuracy'] = pitch_accuracy(times, f0, truth)
+    result['note_accuracy'] = round(sum(e['correct'] for e in notes) / len(timeline), 4) if len(timeline) else 0.0
+    return result
+
+
+def run_yin_live(y, sr, truth):
+    """The detection.py session: band-pass, StreamingYin every 10 ms hop, 80 ms of smoothing."""
+    return run_session(y, sr, truth, backend='yin', window_s=0.05, hop_s=0.01, bandpass=(180.0, 3000.0),
+                       fmin=180.0, fmax=3000.0, smoothing_latency=0.08)
+
+
+def run_crepe(y, sr, truth, capacity='tiny'):
+    """The realtime_detect.py session: 50 ms frames at 16 kHz through crepe, batches of 8, 150 ms of smoothing."""
+    model_sr = 16000
+    estimator = make_estimator('crepe', model_sr, model_capacity=capacity, step_size=10, viterbi=False)
+    y = librosa.resample(y, orig_sr=sr, target_sr=model_sr)
+    return run_session(y, model_sr, truth, min_onset_frames=1, backend='crepe', estimator=estimator,
+                       window_s=0.05, hop_s=0.05, max_batch=8, bandpass=None, amplitude_threshold=0.01,
+                       smoothing_latency=0.15)
+
+
+RUNNERS = {'offline': run_offline, 'yin-live': run_yin_live, 'crepe': run_crepe}
+
+
+# === Reporting ===
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'librosa': librosa.__version__}
+
+
+def compare(run, results, baseline_path, tolerance):
+    """Prints tracked metrics that got worse than the baseline by more than `tolerance` (relative)."""
+    with open(baseline_path) as f:
+        previous = json.load(f)
+    if (previous['run']['score'], previous['run']['notes']) != (run['score'], run['notes']):
+        print(f"Not comparing: {baseline_path} was run on {previous['run']['score']}, not {run['score']}")
+        return []
+    baseline = {(r['scenario'], r['path']): r for r in previous['results']}
+    regressions = []
+    for row in results:
+        before = baseline.get((row['scenario'], row['path']))
+        if before is None or 'error' in row or 'error' in before:
+            continue
+        for metric, direction in TRACKED_METRICS.items():
+            old, new = before.get(metric), row.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            if direction * (new - old) / abs(old) < -tolerance:
+                regressions.append(f"{row['scenario']}/{row['path']} {metric}: {old} -> {new}")
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--score', help="score file to render (default: a random line)")
+    parser.add_argument('--seconds', type=float, default=20.0, help="length of the random line")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--paths', nargs='+', default=list(PATHS), choices=PATHS)
+    parser.add_argument('--crepe-capacity', default='tiny')
+    parser.add_argument('--sr', type=int, default=44100)
+    parser.add_argument('--output', default=os.path.join('bench_results', 'last.json'))
+    parser.add_argument('--history', default=os.path.join('bench_results', 'history.csv'))
+    parser.add_argument('--compare', help="earlier --output JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    notes, bpm = score_notes(args.score) if args.score else random_score(args.seconds)
+    run = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'score': args.score or f"random {args.seconds:g}s",
+           'notes': len(notes), **environment()}
+    options = {'crepe': {'capacity': args.crepe_capacity}}
+    # one untimed pass per path, so imports and first-call setup don't count against throughput
+    warmup, warmup_truth = synthesize(notes[:4], bpm, sr=args.sr)
+    for path in args.paths:
+        try:
+            RUNNERS[path](warmup, args.sr, warmup_truth, **options.get(path, {}))
+        except ImportError:
+            pass
+
+    results = []
+    print(f"{'scenario':<9} {'path':<9} {'xRT':>7} {'p95 ms':>8} {'delay ms':>9} {'onset F':>8} {'pitch acc':>10}")
+    for scenario in args.scenarios:
+        y, truth = synthesize(notes, bpm, sr=args.sr, **SCENARIOS[scenario])
+        for path in args.paths:
+            row = {'scenario': scenario, 'path': path, 'audio_s': round(len(y) / args.sr, 2)}
+            try:
+                row.update(RUNNERS[path](y, args.sr, truth, **options.get(path, {})))
+            except ImportError as e:
+                row['error'] = f"skipped: {e}"
+                print(f"{scenario:<9} {path:<9} {row['error']}")
+                results.append(row)
+                continue
+            results.append(row)
+            print(f"{scenario:<9} {path:<9} {row['x_realtime']:>7.1f} {row['latency_p95_ms']:>8.2f} "
+                  f"{row['algorithmic_delay_ms']:>9.0f} {row['onset_f']:>8.3f} {row['pitch_accuracy']:>10.3f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'run': run, 'results': results}, f, indent=2)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    columns = ['started', 'commit', 'score', 'scenario', 'path', 'audio_s', 'x_realtime', 'latency_p50_ms',
+               'latency_p95_ms', 'latency_p99_ms', 'algorithmic_delay_ms', 'onset_precision', 'onset_recall',
+               'onset_f', 'pitch_accuracy', 'pitch_accuracy_unsmoothed', 'note_accuracy', 'error']
+    new_file = not os.path.exists(args.history)
+    with open(args.history, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        for row in results:
+            writer.writerow({**run, **row})
+    print(f"Results written to {args.output}, appended to {args.history}")
+
+    if args.compare and compare(run, results, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'violai', 'features')
+# a .tmp file older than this is left over from a killed writer, not one still in progress
+STALE_TMP_SECONDS = 3600
+
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    """sha256 of the file bytes, so renamed or copied recordings still hit the cache."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    On-disk cache of extracted audio features, one compressed .npz per entry.
+
+    Entries are keyed by the audio content hash plus the extraction version and
+    parameters, so changing either one never serves stale features. The total
+    size is kept under `max_bytes` by evicting the least recently used entries
+    (a hit refreshes the entry's mtime). Temp files a killed writer left
+    behind count towards the size and are removed once stale.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, file_path, version, params):
+        extraction = json.dumps({'version': version, 'params': params}, sort_keys=True)
+        return hashlib.sha256(
+            (file_content_hash(file_path) + extraction).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                features = {name: data[name] for name in data.files}
+        except (OSError, ValueError) as e:
+            if os.path.exists(path):
+                print(f"Discarding unreadable cache entry {path}: {e}")
+                os.remove(path)
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # evicted by another process meanwhile
+            pass
+        # scalars come back as 0-d arrays
+        return {name: value.item() if value.ndim == 0 else value
+                for name, value in features.items()}
+
+    def store(self, key, features):
+        # write to a temp file and rename, so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **features)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get_or_compute(self, file_path, version, params, compute):
+        """Returns cached features for the file, calling compute(file_path, params) on a miss."""
+        key = self.key(file_path, version, params)
+        features = self.load(key)
+        if features is None:
+            features = compute(file_path, params)
+            self.store(key, features)
+        return features
+
+    def evict(self):
+        """
+        Removes stale temp files, then least recently used entries until the
+        cache fits in max_bytes.
+        """
+        now = time.time()
+        entries, stale = [], []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(('.npz', '.tmp')):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:  # evicted by another process
+                continue
+            total += st.st_size  # a running writer's temp file takes space too
+            if name.endswith('.npz'):
+                entries.append((st.st_mtime, st.st_size, name))
+            elif now - st.st_mtime > STALE_TMP_SECONDS:
+                stale.append((st.st_size, name))
+        for size, name in stale:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,175 @@
+"""
+Synthetic load test for stream_server.py.
+
+Simulates N students playing at once. Each one renders its own random
+line with bench_suite.synthesize, opens a WebSocket, sends the notes in
+its start message, and streams the PCM in real-time paced blocks (or
+faster, with --speed). It then reads the events that come back.
+
+Reported per run:
+    feedback  arrival time of each 'pitch' event minus the time its audio was
+              sent, p50/p95/p99 in ms. This includes the session's algorithmic
+              delay (the server's 'ready' event), so the part spent on compute,
+              queueing and network is feedback minus delay.
+    notes     share of notes judged correct (every synthetic note is played
+              in tune, so anything below 1 is a detection or load failure)
+    load      dropped pitch events, skipped hops and stalled sends (a
+              block sent more than one block late because the server pushed back)
+
+    python stream_load_test.py --spawn --students 16 --seconds 20
+    python stream_load_test.py --url ws://host:8765 --students 50 --speed 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+from websockets.asyncio.client import connect
+
+from bench_suite import random_score, synthesize
+from latency import LatencyHistogram  # bench_suite put violAI-rhythm-baseline on sys.path
+
+
+async def student(url, index, seconds, samplerate, blocksize, speed, sample_format='f32'):
+    """Plays one synthetic take through the server; returns its measurements."""
+    notes, bpm = random_score(seconds, seed=index)
+    y, truth = synthesize(notes, bpm, sr=samplerate, seed=index)
+    payload = y.astype('<f4') if sample_format == 'f32' else (np.clip(y, -1, 1) * 32767).astype('<i2')
+    start = {'type': 'start', 'samplerate': samplerate, 'format': sample_format,
+             'notes': [{'start': s, 'end': e, 'midi': m} for s, e, m in truth['notes']]}
+    feedback = LatencyHistogram()
+    result = {'student': index, 'audio_s': round(len(y) / samplerate, 2), 'stalls': 0}
+
+    async with connect(url, max_size=2 ** 22) as websocket:
+        await websocket.send(json.dumps(start))
+        ready = json.loads(await websocket.recv())[0]
+        if ready['type'] != 'ready':
+            result['error'] = ready.get('message', ready['type'])
+            return result, feedback
+        result['delay_ms'] = 1e3 * ready['delay']
+        sent_at = None  # wall clock at which sample 0 was sent
+
+        async def receive():
+            async for message in websocket:
+                arrived = time.perf_counter()
+                for event in json.loads(message):
+                    if event['type'] == 'pitch' and sent_at is not None:
+                        # the audio at `time` (the frame centre) went out with the block holding that sample
+                        first = int(event['time'] * samplerate) // blocksize * blocksize
+                        feedback.record(arrived - (sent_at + first / samplerate / speed))
+                    elif event['type'] == 'summary':
+                        result.update({key: event[key] for key in ('notes', 'correct', 'dropped_events',
+                                                                   'skipped_hops', 'overruns')})
+                        return
+
+        receiver = asyncio.ensure_future(receive())
+        sent_at = time.perf_counter()
+        for first in range(0, len(payload), blocksize):
+            due = sent_at + first / samplerate / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > blocksize / samplerate / speed:
+                result['stalls'] += 1
+            await websocket.send(payload[first:first + blocksize].tobytes())
+        await websocket.send(json.dumps({'type': 'stop'}))
+        await receiver
+    return result, feedback
+
+
+async def run(url, students, seconds, samplerate, blocksize, speed, ramp_s, sample_format):
+    async def staggered(index):
+        await asyncio.sleep(ramp_s * index / max(students, 1))
+        try:
+            return await student(url, index, seconds, samplerate, blocksize, speed, sample_format)
+        except (OSError, asyncio.TimeoutError) as e:
+            return {'student': index, 'error': str(e)}, LatencyHistogram()
+
+    return await asyncio.gather(*(staggered(i) for i in range(students)))
+
+
+def spawn_server(port, workers, backend):
+    """Starts stream_server.py in its own process (own GIL) and waits until it accepts connections."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stream_server.py")
+    process = subprocess.Popen([sys.executable, script, '--port', str(port), '--workers', str(workers),
+                                '--backend', backend, '--report-every', '0'])
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("stream_server.py exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("stream_server.py did not start within 60 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='ws://127.0.0.1:8765')
+    parser.add_argument('--spawn', action='store_true', help="start a local stream_server.py for the run")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="server threads with --spawn")
+    parser.add_argument('--backend', default='yin', help="server backend with --spawn")
+    parser.add_argument('--students', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=15.0, help="length of each take")
+    parser.add_argument('--samplerate', type=int, default=16000)
+    parser.add_argument('--blocksize', type=int, default=2048, help="samples per WebSocket message")
+    parser.add_argument('--format', default='f32', choices=['f32', 's16'])
+    parser.add_argument('--speed', type=float, default=1.0, help="playback speed, 1 = real time")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds over which students join")
+    parser.add_argument('--output', help="write the per-student results to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        port = int(args.url.rsplit(':', 1)[1].split('/')[0])
+        server = spawn_server(port, args.workers, args.backend)
+    try:
+        started = time.perf_counter()
+        outcomes = asyncio.run(run(args.url, args.students, args.seconds, args.samplerate, args.blocksize,
+                                   args.speed, args.ramp, args.format))
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = [r for r, _ in outcomes]
+    feedback = LatencyHistogram()
+    for _, histogram in outcomes:
+        for index, n in enumerate(histogram.counts):
+            feedback.counts[index] += n
+        feedback.count += histogram.count
+        feedback.total += histogram.total
+        feedback.max = max(feedback.max, histogram.max)
+    failed = [r for r in results if 'error' in r]
+    done = [r for r in results if 'correct' in r]
+    notes = sum(r['notes'] for r in done)
+    summary = feedback.summary()
+    print(f"{args.students} students, {args.speed:g}x real time, {elapsed:.1f} s wall")
+    print(f"feedback  p50 {summary['p50_ms']:.1f}  p95 {summary['p95_ms']:.1f}  p99 {summary['p99_ms']:.1f} ms "
+          f"({summary['count']} pitch events, algorithmic delay "
+          f"{np.mean([r['delay_ms'] for r in done]) if done else 0:.0f} ms)")
+    print(f"notes     {sum(r['correct'] for r in done)}/{notes} correct")
+    print(f"load      {sum(r['dropped_events'] for r in done)} dropped events, "
+          f"{sum(r['skipped_hops'] for r in done)} skipped hops, {sum(r['stalls'] for r in results)} stalled sends")
+    for r in failed:
+        print(f"student {r['student']}: {r['error']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'students': args.students, 'speed': args.speed, 'feedback': summary, 'results': results},
+                      f, indent=2)
+        print(f"Results written to {args.output}")
+    if failed or len(done) < args.students:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,488 @@
+"""
+Live feedback server for the my-app web page.
+
+Browsers stream microphone PCM over a WebSocket, and the server sends back
+expected-versus-played note events. Each connection gets its own
+DetectionSession (violAI-rhythm-baseline/session.py), fed through a
+PushSource, plus a StreamingOnsetFusion (onsetdetect.py) over the session's
+smoothed pitch and RMS track.
+
+Protocol (one WebSocket per take):
+
+    client -> server
+        text    {"type": "start", "samplerate": 16000, "format": "f32" | "s16",
+                 "notes": [{"start": s, "end": s, "midi": 69, "name": "A4"}, ...]
+                 or "score": "<file in --scores>", "pitch_events": true}
+        binary  mono little-endian PCM in the declared format, any block size
+        text    {"type": "stop"}   flush, send the summary and close
+    server -> client
+        text    a JSON array of events: 'ready' (session id, delay in s),
+                then the session's 'pitch', 'note' and 'done' events, 'onset'
+                and 'segment' from the onset fusion, 'summary' at the end and
+                'error'. NaN values are sent as null.
+
+The event loop only moves bytes. Band-passing a block into the ring buffer
+happens on receipt (cheap, keeps the ring single-producer), and the pitch
+and onset analysis runs in a thread pool, one step in flight per session,
+so a slow session never stalls the others. numpy releases the GIL in the
+FFTs and filters that dominate a step, so threads scale across cores up to
+that point. With a model backend and --batch-frames, the windows of all
+sessions go through one BatchScheduler (violAI-rhythm-baseline/
+batch_scheduler.py): one forward pass per 64 windows or 10 ms instead of one
+per session step.
+
+Backpressure, from the client's side of the socket inwards:
+    outbox   a bounded queue per connection. 'pitch' events are dropped when
+             it is full, because the next one supersedes them. Other events
+             wait for room, which holds up that session's analysis.
+    analysis when a session has more than --max-pending seconds of audio
+             waiting, the server stops reading its socket until the
+             current step finishes. WebSocket/TCP flow control then slows
+             the client down.
+    session  hops older than --max-lag are skipped (counted in the summary).
+
+    python stream_server.py --port 8765 --workers 4
+    python stream_load_test.py --spawn --students 16    # synthetic load
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from onsetdetect import StreamingOnsetFusion
+
+# the live-detection modules are shared with the Qt detectors in violAI-rhythm-baseline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "violAI-rhythm-baseline"))
+from batch_scheduler import BatchScheduler
+from capture import PushSource
+from latency import LatencyMonitor
+from pitch_estimators import make_estimator
+from score_compiler import load_score
+from score_timeline import ScoreTimeline
+from session import DetectionSession
+
+# DetectionSession settings per backend: YIN every 10 ms with the default
+# band-pass, or the realtime_detect.py crepe setup
+BACKENDS = {
+    'yin': {'window_s': 0.05, 'hop_s': 0.01, 'max_batch': 10, 'smoothing_latency': 0.08},
+    'crepe': {'window_s': 0.05, 'hop_s': 0.05, 'max_batch': 8, 'bandpass': None,
+              'amplitude_threshold': 0.01, 'smoothing_latency': 0.15},
+}
+SAMPLE_FORMATS = {'f32': ('<f4', 1.0), 's16': ('<i2', 1 / 32768.0)}
+MAX_SAMPLERATE = 96000
+
+
+def _jsonable(event):
+    """Copy of an event without NaN/inf floats (JSON.parse rejects them) and server-only fields."""
+    clean = {}
+    for key, value in event.items():
+        if key == 'heard_at':
+            continue
+        if isinstance(value, (float, np.floating)):
+            value = float(value) if math.isfinite(value) else None
+        elif isinstance(value, np.integer):
+            value = int(value)
+        clean[key] = value
+    return clean
+
+
+def decode_pcm(message, sample_format):
+    """Mono float32 samples of one binary message."""
+    dtype, scale = SAMPLE_FORMATS[sample_format]
+    usable = len(message) - len(message) % np.dtype(dtype).itemsize
+    samples = np.frombuffer(message[:usable], dtype=dtype)
+    return samples.astype(np.float32) * scale if scale != 1.0 else samples
+
+
+def timeline_from_notes(notes):
+    """ScoreTimeline from the client's note list (start/end in s, midi, optional name and id)."""
+    return ScoreTimeline([float(n['start']) for n in notes], [float(n['end']) for n in notes],
+                         [float(n['midi']) if n.get('midi') is not None else np.nan for n in notes],
+                         [str(n.get('id', f"n{i}")) for i, n in enumerate(notes)],
+                         names=[n.get('name') or str(n.get('midi')) for n in notes])
+
+
+def timeline_from_score(path):
+    """
+    ScoreTimeline of a score file, the same one realtime_detect.py builds:
+    first tempo mark (120 bpm if none), chords judged on their first pitch.
+    """
+    return load_score(path, default_bpm=120).timeline()
+
+
+class StudentStream:
+    """
+    One connection: its DetectionSession, onset fusion, outbox and the
+    analysis step in flight.
+    """
+
+    def __init__(self, server, websocket, session_id, session, pitch_events=True):
+        self.server = server
+        self.websocket = websocket
+        self.id = session_id
+        self.session = session
+        self.source = session.source
+        self.onsets = StreamingOnsetFusion()
+        self.pitch_events = pitch_events
+        self.outbox = asyncio.Queue(maxsize=server.outbox)
+        self.dropped_events = 0
+        self.received_samples = 0
+        self.closed = False  # connection gone: nothing drains the outbox any more
+        self._step = None
+
+    # === Analysis (worker thread) ===
+
+    def analyse(self):
+        """Runs the session over every hop that is ready, then the onset fusion over its pitch events."""
+        events = []
+        while self.session.reader.backlog() > 0:
+            events.extend(self.session.process(timeout=0))
+        pitch = [e for e in events if e['type'] == 'pitch']
+        if pitch:
+            fused = self.onsets.push([e['time'] for e in pitch], [e['pitch_hz'] for e in pitch],
+                                     [e['rms'] for e in pitch])
+            events.extend(self._onset_events(fused))
+        return events
+
+    @staticmethod
+    def _onset_events(fused):
+        return [{'type': 'onset', 'time': float(e[1])} if e[0] == 'onset'
+                else {'type': 'segment', 'start': float(e[1]), 'end': float(e[2])} for e in fused]
+
+    def pending_s(self):
+        """Seconds of received audio the analysis has not reached yet."""
+        return self.session.reader.backlog() * self.session.hop / self.session.samplerate
+
+    # === Event loop side ===
+
+    def kick(self):
+        """Starts an analysis step unless one is already running."""
+        if self._step is None or self._step.done():
+            self._step = asyncio.ensure_future(self._run_steps())
+
+    async def _run_steps(self):
+        loop = asyncio.get_running_loop()
+        while self.session.reader.backlog() > 0:
+            started = self.server.latency.now()
+            try:
+                events = await loop.run_in_executor(self.server.pool, self.analyse)
+            except Exception as e:
+                print(f"Session {self.id}: pitch detection error: {e}")
+                return
+            self.server.latency.since('step', started)
+            await self.publish(events)
+
+    async def wait_for_step(self):
+        if self._step is not None:
+            await self._step
+
+    async def publish(self, events):
+        for event in events:
+            if event['type'] == 'pitch' and not self.pitch_events:
+                continue
+            if event['type'] == 'pitch' or self.closed:
+                try:
+                    self.outbox.put_nowait(event)
+                except asyncio.QueueFull:
+                    self.dropped_events += 1  # superseded by the next pitch event, or never sent
+            else:
+                await self.outbox.put(event)
+
+    def close_outbox(self):
+        """
+        Marks the connection gone and empties the outbox, so a step blocked on
+        a full outbox finishes and later events are dropped instead of queued.
+        """
+        self.closed = True
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+
+    async def send_loop(self):
+        """
+        Sends the outbox in batches until the None that ends the take;
+        websocket.send() waits while the client is slow to read. However it
+        ends (the take is over, the connection dropped, it was cancelled),
+        the outbox is closed so no step stays blocked on it.
+        """
+        latency = self.session.latency
+        closing = False
+        try:
+            while not closing:
+                batch = [await self.outbox.get()]
+                while len(batch) < self.server.max_batch_events and not self.outbox.empty():
+                    batch.append(self.outbox.get_nowait())
+                if batch[-1] is None:  # end of the take
+                    closing = True
+                    batch.pop()
+                    if not batch:
+                        break
+                await self.websocket.send(json.dumps([_jsonable(e) for e in batch]))
+                sent = latency.now()
+                for event in batch:
+                    if 'heard_at' in event:
+                        latency.record('server', sent - event['heard_at'])  # audio in -> event on the wire
+        finally:
+            self.close_outbox()
+
+    async def finish(self):
+        """Flushes the analysis and returns the onset tail plus the summary."""
+        await self.wait_for_step()
+        loop = asyncio.get_running_loop()
+        events = await loop.run_in_executor(self.server.pool, self.analyse)
+        duration = (self.session.buffer.written - self.session.origin) / self.session.samplerate
+        events += self._onset_events(self.onsets.finish(duration))
+        status = list(self.session.status.values())
+        reader = self.session.reader
+        events.append({'type': 'summary', 'session': self.id, 'audio_s': round(duration, 3),
+                       'notes': len(status), 'correct': sum(s is True for s in status),
+                       'wrong_or_missed': sum(s is False for s in status),
+                       'dropped_events': self.dropped_events, 'skipped_hops': reader.skipped,
+                       'overruns': reader.overruns, 'latency': self.session.latency.report()})
+        return events
+
+
+class StreamServer:
+    """
+    Accepts connections, builds their sessions and runs the shared worker pool.
+
+    Args:
+        workers (int): analysis threads shared by all sessions.
+        backend (str): a BACKENDS key; crepe loads one model per sample rate,
+            shared by all sessions at that rate.
+        batch_frames (int): with a model backend, windows per cross-session
+            batch (see BatchScheduler); 0 runs each session step on its own.
+        batch_wait_s (float): longest a window waits for its batch to fill.
+        max_sessions (int): connections beyond this get an 'error' and are closed.
+        outbox (int): events queued per connection before 'pitch' events drop.
+        max_pending_s (float): analysis backlog (s) at which a socket stops being read.
+        max_lag_s (float): hops older than this are skipped by the session.
+        scores_dir (str): where "score" names in start messages are looked up.
+    """
+
+    def __init__(self, workers=4, backend='yin', batch_frames=0, batch_wait_s=0.01, max_sessions=64, outbox=256,
+                 max_pending_s=0.5, max_lag_s=0.3, scores_dir='.', max_batch_events=64):
+        self.batching = batch_frames > 0 and backend != 'yin'
+        if self.batching:
+            # steps mostly wait on the scheduler, so every session gets a thread
+            workers = max(workers, max_sessions + 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self.backend = backend
+        self.batch_frames = batch_frames
+        self.batch_wait_s = batch_wait_s
+        self.max_sessions = max_sessions
+        self.outbox = outbox
+        self.max_pending_s = max_pending_s
+        self.max_lag_s = max_lag_s
+        self.scores_dir = os.path.abspath(scores_dir)
+        self.max_batch_events = max_batch_events
+        self.streams = {}
+        self.latency = LatencyMonitor()  # written from the event loop only
+        self._ids = itertools.count(1)
+        self._estimators = {}
+        self._estimators_lock = threading.Lock()
+        self._scores = {}  # path -> (mtime, timeline), the file's current version only
+        self._opening = 0  # sessions past the max_sessions check, not yet in self.streams
+
+    def _estimator(self, samplerate):
+        if self.backend == 'yin':
+            return None
+        with self._estimators_lock:
+            if samplerate not in self._estimators:
+                estimator = make_estimator(self.backend, samplerate)
+                if self.batching:
+                    estimator = BatchScheduler(estimator, self.batch_frames, self.batch_wait_s)
+                self._estimators[samplerate] = estimator
+            return self._estimators[samplerate]
+
+    def _score(self, name):
+        """
+        Timeline of a score file in scores_dir, built once per file version
+        (compiled scores are cached on disk); an edit replaces the old entry.
+
+        Raises:
+            OSError: if the file is missing.
+            ValueError: if it can't be parsed.
+        """
+        path = os.path.join(self.scores_dir, os.path.basename(name))
+        mtime = os.path.getmtime(path)
+        cached = self._scores.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            timeline = timeline_from_score(path)
+        except OSError:
+            raise
+        except Exception as e:
+            # music21 has its own exception types; report them like any bad start message
+            raise ValueError(f"cannot load score {name}: {e}") from e
+        self._scores[path] = (mtime, timeline)
+        return timeline
+
+    async def _open_session(self, config):
+        samplerate = int(config.get('samplerate', 16000))
+        if not 8000 <= samplerate <= MAX_SAMPLERATE:
+            raise ValueError(f"samplerate {samplerate} out of range")
+        if config.get('format', 'f32') not in SAMPLE_FORMATS:
+            raise ValueError(f"unknown format {config.get('format')!r}, expected one of {list(SAMPLE_FORMATS)}")
+        loop = asyncio.get_running_loop()
+        if config.get('notes'):
+            timeline = timeline_from_notes(config['notes'])
+        elif config.get('score'):
+            # a first compile parses the MusicXML (seconds); keep it off the event loop
+            timeline = await loop.run_in_executor(self.pool, self._score, config['score'])
+        else:
+            timeline = None
+        estimator = await loop.run_in_executor(self.pool, self._estimator, samplerate)
+        session = DetectionSession(PushSource(samplerate), timeline, samplerate=samplerate, backend=self.backend,
+                                   estimator=estimator, max_lag_s=self.max_lag_s, **BACKENDS[self.backend])
+        await loop.run_in_executor(self.pool, session.warm_up)
+        session.reset()
+        session.source.start(session.write)
+        return session
+
+    async def handler(self, websocket):
+        try:
+            config = json.loads(await websocket.recv())
+            if not isinstance(config, dict) or config.get('type') != 'start':
+                raise ValueError("the first message must be a 'start' message")
+            if len(self.streams) + self._opening >= self.max_sessions:
+                raise ValueError("server is full, try again later")
+            # opening takes seconds; hold the slot so concurrent starts can't all pass the check
+            self._opening += 1
+            try:
+                session = await self._open_session(config)
+            finally:
+                self._opening -= 1
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            await websocket.send(json.dumps([{'type': 'error', 'message': str(e)}]))
+            await websocket.close()
+            return
+        except ConnectionClosed:
+            return
+
+        stream = StudentStream(self, websocket, next(self._ids), session,
+                               pitch_events=config.get('pitch_events', True))
+        self.streams[stream.id] = stream
+        sample_format = config.get('format', 'f32')
+        await stream.outbox.put({'type': 'ready', 'session': stream.id, 'samplerate': session.samplerate,
+                                 'backend': self.backend, 'delay': round(session.delay, 4)})
+        sender = asyncio.ensure_future(stream.send_loop())
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    samples = decode_pcm(message, sample_format)
+                    stream.received_samples += len(samples)
+                    stream.source.push(samples)
+                    stream.kick()
+                    if stream.pending_s() > self.max_pending_s:
+                        await stream.wait_for_step()  # stop reading until the analysis catches up
+                    continue
+                try:
+                    control = json.loads(message)
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await stream.publish([{'type': 'error', 'message': "text messages must be JSON objects"}])
+                elif control.get('type') == 'stop':
+                    await stream.publish(await stream.finish())
+                    if not stream.closed:
+                        await stream.outbox.put(None)
+                    await sender  # sends what is queued, then returns
+                    break
+        except ConnectionClosed:
+            pass
+        except ValueError as e:
+            print(f"Session {stream.id}: bad message: {e}")
+        finally:
+            stream.close_outbox()
+            sender.cancel()
+            try:
+                await sender
+            except (asyncio.CancelledError, ConnectionClosed):
+                pass
+            except Exception as e:
+                print(f"Session {stream.id}: send error: {e}")
+            await stream.wait_for_step()
+            stream.source.stop()
+            del self.streams[stream.id]
+            await websocket.close()
+
+    def stats(self):
+        step = self.latency.stages.get('step')
+        stats = {'sessions': len(self.streams),
+                 'step': step.summary() if step is not None else None,
+                 'pending_s_max': round(max((s.pending_s() for s in self.streams.values()), default=0.0), 3),
+                 'dropped_events': sum(s.dropped_events for s in self.streams.values())}
+        if self.batching:
+            stats['batching'] = {sr: scheduler.report() for sr, scheduler in list(self._estimators.items())}
+        return stats
+
+    async def report_loop(self, every_s):
+        while True:
+            await asyncio.sleep(every_s)
+            stats = self.stats()
+            if stats['sessions']:
+                step = stats['step'] or {}
+                print(f"{stats['sessions']} sessions | step p50 {step.get('p50_ms', 0):.1f} ms, "
+                      f"p95 {step.get('p95_ms', 0):.1f} ms | max backlog {stats['pending_s_max']:.2f} s | "
+                      f"dropped events {stats['dropped_events']}")
+                for sr, report in stats.get('batching', {}).items():
+                    wait = report['stages'].get('queue_wait', {})
+                    print(f"  {sr} Hz batches: mean {report['mean_batch']:.1f} windows "
+                          f"(max {report['gauges'].get('batch_frames', {}).get('max', 0)}), "
+                          f"queue wait p95 {wait.get('p95_ms', 0):.1f} ms")
+
+    async def serve(self, host, port, report_every_s=10.0):
+        async with serve(self.handler, host, port, max_size=2 ** 20) as server:
+            print(f"Listening on ws://{host}:{port} ({self.backend}, {self.pool._max_workers} workers)")
+            reporter = asyncio.ensure_future(self.report_loop(report_every_s)) if report_every_s else None
+            try:
+                await server.serve_forever()
+            finally:
+                if reporter is not None:
+                    reporter.cancel()
+                if self.batching:
+                    for scheduler in self._estimators.values():
+                        scheduler.close()
+                self.pool.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help="analysis threads")
+    parser.add_argument('--backend', default='yin', choices=list(BACKENDS))
+    parser.add_argument('--batch-frames', type=int, default=64,
+                        help="windows per cross-session model batch, 0 for none (model backends only)")
+    parser.add_argument('--batch-wait-ms', type=float, default=10.0, help="longest a window waits for its batch")
+    parser.add_argument('--max-sessions', type=int, default=64)
+    parser.add_argument('--outbox', type=int, default=256, help="queued events per connection")
+    parser.add_argument('--max-pending', type=float, default=0.5, help="analysis backlog (s) before reads pause")
+    parser.add_argument('--max-lag', type=float, default=0.3, help="hops older than this (s) are skipped")
+    parser.add_argument('--scores', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "violAI-rhythm-baseline"))
+    parser.add_argument('--report-every', type=float, default=10.0, help="seconds between load reports, 0 for none")
+    args = parser.parse_args()
+
+    server = StreamServer(workers=args.workers, backend=args.backend, batch_frames=args.batch_frames,
+                          batch_wait_s=args.batch_wait_ms / 1000.0, max_sessions=args.max_sessions,
+                          outbox=args.outbox, max_pending_s=args.max_pending, max_lag_s=args.max_lag,
+                          scores_dir=args.scores)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.report_every))
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Cross-session micro-batching for pitch-model inference.
+
+With many sessions live, each one calling crepe on its own few frames spends
+most of the CPU on per-call overhead (graph dispatch, thread hand-offs), not
+on the model. A BatchScheduler sits between the sessions and one shared
+PitchEstimator. Sessions submit their windows, and a scheduler thread sends
+everything pending through a single estimate_many() call, then routes each
+result back to the session that asked for it.
+
+A batch is flushed as soon as either limit is reached:
+    max_frames  windows pending across all sessions (a session's request is
+                never split, so a batch stops short of it rather than
+                split one, and a single larger request goes alone)
+    max_wait_s  time since the oldest pending window arrived, the latency
+                a session pays at most for batching
+
+The scheduler is a drop-in estimator: pass it as DetectionSession's
+`estimator` and the session's estimate_many() call blocks until its batch is
+done. The calling thread is only waiting, so servers should run one
+analysis thread per session rather than one per core.
+
+Metrics (report()): 'queue_wait' (submit to batch start, per request) and
+'inference' (per batch) latency histograms, the batch size distribution and
+counters for flushes by size and by deadline. These are the numbers for
+sizing a server: queue_wait against the deadline, and batch size against
+the model's throughput curve.
+"""
+import threading
+from collections import deque
+
+from latency import LatencyMonitor
+
+
+class _Request:
+    def __init__(self, signals, submitted):
+        self.signals = signals
+        self.submitted = submitted
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchScheduler:
+    """
+    Args:
+        estimator (PitchEstimator): the shared backend; only the scheduler
+            thread calls it.
+        max_frames (int): windows per batch that trigger an immediate flush.
+        max_wait_s (float): longest a window waits for a batch to fill.
+    """
+
+    def __init__(self, estimator, max_frames=64, max_wait_s=0.01):
+        self.estimator = estimator
+        self.name = estimator.name
+        self.sr = estimator.sr
+        self.max_frames = max_frames
+        self.max_wait_s = max_wait_s
+        self.latency = LatencyMonitor()  # written by the scheduler thread only
+        self.batch_sizes = {}  # windows per batch -> number of batches
+        self._pending = deque()
+        self._pending_frames = 0
+        self._changed = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # === Session side ===
+
+    def submit(self, signals):
+        """Queues windows for the next batch; returns a request to wait on."""
+        request = _Request(list(signals), self.latency.now())
+        with self._changed:
+            if not self._running:
+                raise RuntimeError("BatchScheduler is closed")
+            self._pending.append(request)
+            self._pending_frames += len(request.signals)
+            self._changed.notify()
+        return request
+
+    def estimate_many(self, signals):
+        """Same as the wrapped estimator's, through the shared batch; blocks until it is done."""
+        if not signals:
+            return []
+        request = self.submit(signals)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def estimate(self, y):
+        return self.estimate_many([y])[0]
+
+    # === Scheduler thread ===
+
+    def _next_batch(self):
+        """Waits for a full batch or the oldest window's deadline; None once closed and empty."""
+        with self._changed:
+            while self._running and not self._pending:
+                self._changed.wait()
+            if not self._pending:
+                return None, None
+            deadline = self._pending[0].submitted + self.max_wait_s
+            while self._running and self._pending_frames < self.max_frames:
+                remaining = deadline - self.latency.now()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            reason = 'flush_full' if self._pending_frames >= self.max_frames else 'flush_deadline'
+            batch = [self._pending.popleft()]
+            frames = len(batch[0].signals)
+            while self._pending and frames + len(self._pending[0].signals) <= self.max_frames:
+                batch.append(self._pending.popleft())
+                frames += len(batch[-1].signals)
+            self._pending_frames -= frames
+            return batch, reason
+
+    def _run(self):
+        while True:
+            batch, reason = self._next_batch()
+            if batch is None:
+                return
+            started = self.latency.now()
+            for request in batch:
+                self.latency.record('queue_wait', started - request.submitted)
+            signals = [y for request in batch for y in request.signals]
+            try:
+                results = self.estimator.estimate_many(signals)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                self.latency.count('errors')
+                continue
+            self.latency.since('inference', started)
+            self.latency.count(reason)
+            self.latency.count('batches')
+            self.latency.count('frames', len(signals))
+            self.latency.gauge('batch_frames', len(signals))
+            self.batch_sizes[len(signals)] = self.batch_sizes.get(len(signals), 0) + 1
+            start = 0
+            for request in batch:
+                request.results = results[start:start + len(request.signals)]
+                start += len(request.signals)
+                request.done.set()
+
+    # === Metrics ===
+
+    def report(self):
+        """LatencyMonitor.report() plus 'mean_batch' and 'batch_sizes' (windows -> batches)."""
+        report = self.latency.report()
+        counters = report['counters']
+        batches = counters.get('batches', 0)
+        report['mean_batch'] = round(counters.get('frames', 0) / batches, 2) if batches else 0.0
+        report['batch_sizes'] = dict(sorted(list(self.batch_sizes.items())))
+        return report
+
+    def close(self):
+        """Runs what is still pending, then stops the scheduler thread."""
+        with self._changed:
+            self._running = False
+            self._changed.notify_all()
+        self._thread.join()
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of the audio buffer used by the live detectors.
+
+Compares the old deque(maxlen=...) buffer (extend per callback, list copy per
+read) with RingBuffer (one vectorized write per callback, zero-copy read).
+
+    python bench_ring_buffer.py --samplerate 44100 --blocksize 1024
+"""
+import argparse
+import timeit
+from collections import deque
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samplerate', type=int, default=44100)
+    parser.add_argument('--blocksize', type=int, default=1024)
+    parser.add_argument('--buffer-seconds', type=float, default=2.0)
+    parser.add_argument('--window-seconds', type=float, default=0.05)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    capacity = int(args.samplerate * args.buffer_seconds)
+    window = int(args.samplerate * args.window_seconds)
+    # sounddevice hands the callback a (frames, channels) float32 block
+    indata = np.random.default_rng(0).normal(0, 0.1, (args.blocksize, 1)).astype(np.float32)
+
+    dq = deque(maxlen=capacity)
+    ring = RingBuffer(capacity)
+    for _ in range(capacity // args.blocksize + 1):
+        dq.extend(indata[:, 0])
+        ring.write(indata[:, 0])
+
+    results = {
+        'deque callback': timeit.timeit(lambda: dq.extend(indata[:, 0]), number=args.number),
+        'ring callback': timeit.timeit(lambda: ring.write(indata[:, 0]), number=args.number),
+        'deque read': timeit.timeit(
+            lambda: np.array(list(dq)[-window:], dtype=np.float32), number=args.number),
+        'ring read': timeit.timeit(lambda: ring.latest(window), number=args.number),
+    }
+
+    print(f"{capacity} sample buffer, {args.blocksize} sample blocks, {window} sample reads")
+    for name, total in results.items():
+        print(f"{name:>15}: {total / args.number * 1e6:10.2f} us/call")
+    print(f"callback speedup: {results['deque callback'] / results['ring callback']:.0f}x, "
+          f"read speedup: {results['deque read'] / results['ring read']:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Audio sources and gapless frame reading for the live detectors.
+
+A source delivers mono float32 blocks to a `write(block, overflowed=False,
+input_latency=None)` callable, normally DetectionSession.write, which
+band-passes them into the session's RingBuffer. Audio keeps arriving while
+inference runs, and nothing is lost between analysis frames.
+
+    MicrophoneSource  a sounddevice.InputStream (the only source that needs
+                      sounddevice, imported when one is created)
+    ArraySource       a recorded or synthetic signal, played in real time or
+                      as fast as possible, from its own thread
+    PushSource        blocks handed in by the caller, e.g. PCM received by a
+                      server
+
+FrameReader hands fixed-size frames to the inference thread in capture
+order. When inference falls behind, it applies a backlog policy:
+
+    'latest'  skip to the newest complete frame (lowest latency)
+    'all'     process every frame; only frames the ring already overwrote
+              are lost, or, with max_lag, skip ahead once the backlog is
+              longer than max_lag samples
+
+Counters make any loss visible instead of silent:
+    MicrophoneSource.dropouts  blocks the audio driver flagged as overflowed
+    FrameReader.overruns       frames overwritten before inference reached them
+    FrameReader.skipped        frames dropped on purpose by the policy
+"""
+import threading
+import time
+
+import numpy as np
+
+BACKLOG_POLICIES = ('latest', 'all')
+
+
+class MicrophoneSource:
+    """Continuous mono input stream from the default (or given) input device."""
+
+    def __init__(self, samplerate, blocksize=0, device=None):
+        import sounddevice as sd  # optional: servers feed audio through PushSource instead
+        self.samplerate = samplerate
+        self.dropouts = 0
+        self._write = None
+        self.stream = sd.InputStream(samplerate=samplerate, channels=1, blocksize=blocksize, device=device,
+                                     dtype='float32', callback=self._callback)
+
+    def _callback(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            self.dropouts += 1
+        # inputBufferAdcTime is 0 where the host API doesn't report it
+        input_latency = (time_info.currentTime - time_info.inputBufferAdcTime
+                         if time_info.inputBufferAdcTime > 0 else None)
+        self._write(indata[:, 0], status.input_overflow, input_latency)
+
+    def start(self, write):
+        self._write = write
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+
+    def close(self):
+        self.stream.close()
+
+
+class ArraySource:
+    """
+    Plays a signal block by block from a thread.
+
+    Args:
+        speed (float, optional): 1.0 paces the blocks in real time; None
+            writes as fast as possible (the consumer must keep up, or
+            FrameReader counts overruns).
+    """
+
+    def __init__(self, y, samplerate, blocksize=1024, speed=1.0):
+        self.y = np.asarray(y, dtype=np.float32)
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.speed = speed
+        self.finished = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, write):
+        self.finished.clear()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._play, args=(write,), daemon=True)
+        self._thread.start()
+
+    def _play(self, write):
+        started = time.perf_counter()
+        for first in range(0, len(self.y), self.blocksize):
+            if self._stopped.is_set():
+                break
+            if self.speed:
+                delay = started + first / self.samplerate / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            write(self.y[first:first + self.blocksize])
+        self.finished.set()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        self.stop()
+
+
+class PushSource:
+    """Blocks pushed by the caller with push(); start() just connects it to the consumer."""
+
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self._write = None
+
+    def start(self, write):
+        self._write = write
+
+    def push(self, block):
+        if self._write is None:
+            raise RuntimeError("PushSource is not started")
+        self._write(np.asarray(block, dtype=np.float32).ravel())
+
+    def stop(self):
+        self._write = None
+
+    def close(self):
+        self.stop()
+
+
+class FrameReader:
+    """
+    Reads frame_length-sample frames every hop_length samples from a
+    RingBuffer, starting at absolute sample position `start`.
+
+    Args:
+        policy (str): 'latest' or 'all', see the module docstring.
+        max_lag (int, optional): with 'all', the backlog in samples beyond
+            which the reader skips to the newest frame.
+        copy (bool): copy each frame out of the buffer. Turn it off when the
+            consumer reads the buffer itself and only needs the frame ends;
+            frames are then returned as None.
+    """
+
+    def __init__(self, buffer, frame_length, hop_length=None, policy='latest', start=0, max_lag=None,
+                 copy=True):
+        if policy not in BACKLOG_POLICIES:
+            raise ValueError(f"Unknown backlog policy {policy!r}, expected one of {BACKLOG_POLICIES}")
+        self.buffer = buffer
+        self.frame_length = frame_length
+        self.hop_length = hop_length or frame_length
+        self.policy = policy
+        self.max_lag = max_lag
+        self.copy = copy
+        self.next_end = start + frame_length  # end sample of the next frame
+        self.overruns = 0
+        self.skipped = 0
+
+    def backlog(self):
+        """Complete frames waiting to be read."""
+        waiting = self.buffer.written - self.next_end
+        return waiting // self.hop_length + 1 if waiting >= 0 else 0
+
+    def read(self, timeout=None):
+        """
+        Waits for the next frame per the backlog policy.
+
+        Returns:
+            tuple: (end, frame), where `end` is the absolute sample position just
+                after the frame and `frame` a float32 copy (safe to hold while
+                the callback keeps writing), or None without `copy`. None if the
+                timeout expired first.
+        """
+        if not self.buffer.wait_until(self.next_end, timeout):
+            return None
+        while True:
+            written = self.buffer.written
+            if self.policy == 'latest' or (self.max_lag is not None and written - self.next_end > self.max_lag):
+                waiting = (written - self.next_end) // self.hop_length
+                self.skipped += waiting
+                self.next_end += waiting * self.hop_length
+            else:
+                oldest_end = written - self.buffer.capacity + self.frame_length
+                if self.next_end < oldest_end:
+                    lost = -(-(oldest_end - self.next_end) // self.hop_length)
+                    self.overruns += lost
+                    self.next_end += lost * self.hop_length
+            if not self.copy:
+                end = self.next_end
+                self.next_end += self.hop_length
+                return end, None
+            try:
+                frame = self.buffer.window(self.next_end, self.frame_length).copy()
+            except ValueError:
+                continue  # the callback overwrote it meanwhile; recount
+            # a copy taken while the callback wrapped over it would be torn
+            if self.buffer.written - self.buffer.capacity + self.frame_length > self.next_end:
+                continue
+            end = self.next_end
+            self.next_end += self.hop_length
+            return end, frame
+
+    def read_batch(self, max_frames, timeout=None):
+        """
+        Waits for one frame, then also takes the frames already waiting behind
+        it (up to max_frames in total), so a backlog goes through inference in
+        one batch. Under 'latest' the batch is just the newest frame.
+
+        Returns:
+            list: (end, frame) tuples in capture order, empty on timeout.
+        """
+        first = self.read(timeout)
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < max_frames and self.backlog() > 0:
+            batch.append(self.read())
+        return batch
+
+    def stats(self):
+        return {'overruns': self.overruns, 'skipped': self.skipped, 'backlog': self.backlog()}
@@ -0,0 +1,247 @@
+"""
+Pitch inference in its own process, fed and read through shared memory.
+
+In one process the audio callback, the numpy/librosa detection loop and the
+Qt event loop share one GIL, so a busy UI delays detection and the other way
+round. ProcessSession is a stand-in for DetectionSession that runs the
+session's analysis in a child process with its own interpreter:
+
+    UI process                          inference process
+    source -> band-pass --------------> audio SharedRingBuffer (float32)
+                                        DetectionSession.process()
+    sinks <- results thread <---------- result SharedRingBuffer (float64 records)
+
+Both rings are SharedRingBuffers, so samples and results cross without
+pickling or copying. Only the start/stop commands and the end-of-take
+summary go through a Pipe. Each event is one fixed-width record (RECORD_FIELDS).
+The UI side rebuilds the same event dicts DetectionSession emits, so
+front-ends don't change.
+
+The child process is spawned once, by the first start(), and stays alive
+between takes, so the model and librosa load once. Its latency stages
+(queue, pitch, match) are merged into `latency` when a take stops.
+Timestamps use time.perf_counter, which is system-wide on Linux, macOS and
+Windows, so heard_at values from the child can be compared with the UI's.
+"""
+import multiprocessing
+import threading
+
+import numpy as np
+import librosa
+
+from latency import LatencyMonitor
+from ring_buffer import SharedRingBuffer
+from score_timeline import ScoreTimeline
+from session import DetectionSession
+from stream_filter import StreamingBandpass
+
+RECORD_FIELDS = ('type', 'time', 'pitch_hz', 'rms', 'expected', 'index', 'correct', 'missed', 'heard_at')
+EVENT_TYPES = ('pitch', 'note', 'done')
+RECORD_WIDTH = len(RECORD_FIELDS)
+
+
+def encode_events(events):
+    """(n, RECORD_WIDTH) float64 records of session events."""
+    records = np.full((len(events), RECORD_WIDTH), np.nan)
+    for row, event in zip(records, events):
+        row[0] = EVENT_TYPES.index(event['type'])
+        for k, field in enumerate(RECORD_FIELDS[1:], start=1):
+            if field in event:
+                row[k] = event[field]
+    return records
+
+
+def _inference_main(audio, results, conn, timeline, options):
+    """Child process: one DetectionSession over the shared audio ring, driven by commands on `conn`."""
+    session = DetectionSession(None, timeline, buffer=audio, bandpass=None, **options)
+    session.warm_up()
+    conn.send(('loaded', session.delay))
+    while True:
+        command = conn.recv()
+        if command == 'close':
+            break
+        if command != 'start':
+            continue
+        session.reset()
+        conn.send(('started', session.origin))
+        while not conn.poll():
+            try:
+                events = session.process(timeout=0.05)
+            except Exception as e:
+                print(f"Pitch detection error: {e}")
+                continue
+            if events:
+                results.write(encode_events(events).ravel())
+        conn.recv()  # 'stop'
+        reader = session.reader
+        conn.send(('stopped', {'latency': session.latency, 'overruns': reader.overruns, 'skipped': reader.skipped}))
+    audio.close()
+    results.close()
+
+
+class ProcessSession:
+    """
+    DetectionSession with its analysis in a child process.
+
+    Args:
+        source, timeline, sinks, samplerate, bandpass, buffer_seconds, slo_ms:
+            as for DetectionSession; the band-pass runs on this side, in the
+            source callback.
+        result_capacity (int): events the result ring holds before the
+            results thread has to have read them.
+        **options: DetectionSession arguments for the child (backend,
+            window_s, hop_s, max_batch, max_lag_s, smoothing_latency, ...).
+            The estimator is built in the child from `backend`, so `estimator`
+            instances are not accepted.
+    """
+
+    def __init__(self, source, timeline=None, sinks=(), samplerate=44100, bandpass=(180.0, 3000.0),
+                 buffer_seconds=2.0, slo_ms=None, result_capacity=4096, **options):
+        self.source = source
+        self.timeline = timeline
+        self.sinks = list(sinks)
+        self.samplerate = samplerate
+        self.bandpass = StreamingBandpass(bandpass[0], bandpass[1], samplerate) if bandpass else None
+        self.audio = SharedRingBuffer(int(samplerate * buffer_seconds))
+        self.results = SharedRingBuffer(result_capacity * RECORD_WIDTH, dtype=np.float64)
+        self.options = dict(options, samplerate=samplerate, buffer_seconds=buffer_seconds, slo_ms=slo_ms)
+        self.latency = LatencyMonitor(slo_ms=slo_ms)
+        self.running = False
+        self.delay = None
+        self.child = None
+        self._conn = None
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.status = {event_id: None for event_id in self.timeline.ids} if self.timeline is not None else {}
+        self.pitches_played = []
+        self.dropouts = 0
+        self.lost_events = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.done = False
+
+    def _spawn(self):
+        # a plain copy of the timeline: music21 elements stay in this process
+        timeline = self.timeline
+        if timeline is not None:
+            timeline = ScoreTimeline(timeline.starts, timeline.ends, timeline.pitches, timeline.ids,
+                                     names=timeline.names)
+        context = multiprocessing.get_context('spawn')  # never fork a process that runs Qt
+        self._conn, child_conn = context.Pipe()
+        self.child = context.Process(target=_inference_main, name='pitch-inference', daemon=True,
+                                       args=(self.audio, self.results, child_conn, timeline, self.options))
+        self.child.start()
+        _, self.delay = self._conn.recv()
+
+    # === Audio in ===
+
+    def write(self, block, overflowed=False, input_latency=None):
+        """Source callback: band-passes one block into the shared audio ring."""
+        start = self.latency.now()
+        if overflowed:
+            self.dropouts += 1
+            self.latency.count('dropped_blocks')
+        if input_latency is not None:
+            self.latency.record('capture', input_latency)
+        if self.bandpass is not None:
+            block = self.bandpass.process(block)
+        self.audio.write(block)
+        self.latency.since('filter', start)
+
+    # === Results in ===
+
+    def _decode(self, record):
+        kind = EVENT_TYPES[int(record[0])]
+        if kind == 'done':
+            self.done = True
+            return {'type': 'done', 'time': record[1]}
+        if kind == 'note':
+            i = int(record[5])
+            event_id = self.timeline.ids[i]
+            self.status[event_id] = bool(record[6])
+            return {'type': 'note', 'id': event_id, 'index': i, 'correct': bool(record[6]),
+                    'missed': bool(record[7]), 'time': record[1], 'pitch_hz': record[2], 'heard_at': record[8]}
+        pitch_hz = record[2]
+        note_name = librosa.hz_to_note(pitch_hz) if np.isfinite(pitch_hz) else None
+        if note_name is not None:
+            self.pitches_played.append({'note_name': note_name, 'estimated_pitch': round(float(pitch_hz), 2),
+                                        'time': round(float(record[1]), 2)})
+        i = int(record[4])
+        return {'type': 'pitch', 'time': record[1], 'pitch_hz': pitch_hz, 'note_name': note_name,
+                'rms': record[3], 'expected': i,
+                'expected_name': self.timeline.names[i] if self.timeline is not None and i >= 0 else None,
+                'heard_at': record[8]}
+
+    def _read_results(self, cursor):
+        """Results thread: turns result records into events for the sinks until the take stops."""
+        while True:
+            if not self.results.wait_until(cursor + RECORD_WIDTH, timeout=0.05):
+                if not self.running:
+                    return
+                continue
+            written = self.results.written
+            oldest = written - self.results.capacity
+            if cursor < oldest:
+                self.lost_events += (oldest - cursor) // RECORD_WIDTH
+                cursor = oldest
+            try:
+                records = self.results.window(written, written - cursor).reshape(-1, RECORD_WIDTH).copy()
+            except ValueError:
+                continue  # the child overwrote it meanwhile; recount
+            # a copy taken while the child wrapped over it would be torn
+            if self.results.written - self.results.capacity > cursor:
+                continue
+            cursor = written
+            for record in records:
+                event = self._decode(record)
+                for sink in self.sinks:
+                    sink(event)
+
+    # === Takes ===
+
+    def start(self):
+        """Starts a new take: spawns the inference process if needed, then the source and results thread."""
+        if self.running:
+            return
+        if self.child is None:
+            self._spawn()
+        self._reset()
+        if self.bandpass is not None:
+            self.bandpass.reset()
+        self.latency.reset()
+        cursor = self.results.written
+        self._conn.send('start')
+        self._conn.recv()  # the child reset its session at the current end of the audio ring
+        self.running = True
+        self._thread = threading.Thread(target=self._read_results, args=(cursor,), daemon=True)
+        self._thread.start()
+        self.source.start(self.write)
+
+    def stop(self):
+        """Stops the source and the take; merges the child's latency stages. Safe to call from a sink."""
+        if not self.running:
+            return
+        self.source.stop()
+        self._conn.send('stop')
+        _, summary = self._conn.recv()
+        self.running = False
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self.latency.merge(summary['latency'])
+        self.overruns = summary['overruns']
+        self.skipped = summary['skipped']
+        if self.lost_events:
+            self.latency.count('lost_events', self.lost_events)
+
+    def close(self):
+        """Stops the take, ends the inference process and frees the shared memory."""
+        self.stop()
+        self.source.close()
+        if self.child is not None:
+            self._conn.send('close')
+            self.child.join(timeout=5)
+            self.child = None
+        self.audio.close()
+        self.results.close()
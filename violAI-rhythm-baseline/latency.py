@@ -0,0 +1,184 @@
+"""
+Per-stage latency instrumentation for the live pipelines.
+
+Each stage boundary takes a monotonic timestamp (time.perf_counter) and the
+duration goes into a log-binned histogram, so p50/p95/p99 cost one list
+increment per sample and no stored history:
+
+    t = latency.now()
+    f0 = estimate(...)
+    t = latency.since('pitch', t)   # records the stage, returns the new boundary
+    ...
+
+Histograms take no lock. Each stage, counter and gauge is written by one
+thread only (the audio callback owns 'capture'/'filter', the detection thread
+the rest), and readers (the overlay, the final report) read a snapshot that
+may be one sample stale. report() gives everything as one dict, with
+pass/fail against an optional latency SLO; dump() writes it as JSON at the
+end of a session.
+"""
+import json
+import math
+import time
+
+
+class LatencyHistogram:
+    """
+    Durations in log-spaced bins between min_s and max_s (bins_per_decade per
+    10x, ~6% resolution at 40), plus one underflow and one overflow bin.
+    Single writer; see the module docstring.
+    """
+
+    def __init__(self, min_s=1e-5, max_s=10.0, bins_per_decade=40):
+        self.min_s = min_s
+        self.bins_per_decade = bins_per_decade
+        self.counts = [0] * (int(math.ceil(math.log10(max_s / min_s) * bins_per_decade)) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        seconds = float(seconds)
+        if seconds <= self.min_s:
+            index = 0
+        else:
+            index = min(len(self.counts) - 1, 1 + int(math.log10(seconds / self.min_s) * self.bins_per_decade))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Adds the samples of another histogram with the same bins."""
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper edge of the bin holding the q-th percentile, in seconds (0 if empty)."""
+        counts = list(self.counts)
+        target = q / 100.0 * sum(counts)
+        cumulative = 0
+        for index, n in enumerate(counts):
+            cumulative += n
+            if n and cumulative >= target:
+                return min(self.min_s * 10 ** (index / self.bins_per_decade), self.max)
+        return 0.0
+
+    def summary(self):
+        """Count plus mean/p50/p95/p99/max in milliseconds."""
+        count = self.count
+        return {'count': count,
+                'mean_ms': round(1e3 * self.total / count, 3) if count else 0.0,
+                'p50_ms': round(1e3 * self.percentile(50), 3),
+                'p95_ms': round(1e3 * self.percentile(95), 3),
+                'p99_ms': round(1e3 * self.percentile(99), 3),
+                'max_ms': round(1e3 * self.max, 3)}
+
+
+class LatencyMonitor:
+    """
+    Stage histograms, event counters (dropped blocks, skipped hops, ...) and
+    gauges (queue depth: last and max value) for one session.
+
+    Args:
+        slo_ms (dict, optional): stage -> limit in ms that the stage's
+            slo_percentile must stay under, e.g. {'end_to_end': 150}.
+        slo_percentile (int): which percentile the limits apply to.
+    """
+
+    now = staticmethod(time.perf_counter)
+
+    def __init__(self, slo_ms=None, slo_percentile=95):
+        self.slo_ms = dict(slo_ms or {})
+        self.slo_percentile = slo_percentile
+        self.reset()
+
+    def reset(self):
+        """Starts a new session: clears every stage, counter and gauge."""
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def _histogram(self, stage):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def record(self, stage, seconds):
+        self._histogram(stage).record(seconds)
+
+    def since(self, stage, start):
+        """Records now - start for `stage`; returns now, the start of the next stage."""
+        end = time.perf_counter()
+        self._histogram(stage).record(end - start)
+        return end
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def gauge(self, name, value):
+        _, peak = self.gauges.get(name, (value, value))
+        self.gauges[name] = (value, max(peak, value))
+
+    def merge(self, other):
+        """
+        Adds another monitor's stages, counters and gauges, e.g. those a
+        session recorded in an inference process.
+        """
+        for stage, histogram in list(other.stages.items()):
+            self._histogram(stage).merge(histogram)
+        for counter, n in list(other.counters.items()):
+            self.count(counter, n)
+        for name, (last, peak) in list(other.gauges.items()):
+            _, own_peak = self.gauges.get(name, (last, peak))
+            self.gauges[name] = (last, max(own_peak, peak))
+
+    def report(self):
+        """
+        Returns:
+            dict: 'stages' (name -> LatencyHistogram.summary(), plus 'slo_ms' and
+                'slo_met' for stages with a limit), 'counters', 'gauges'
+                (name -> {'last', 'max'}), 'duration_s' and 'slo_met' (True
+                when every limited stage met its limit).
+        """
+        stages = {}
+        slo_met = True
+        for stage, histogram in list(self.stages.items()):
+            stages[stage] = histogram.summary()
+            if stage in self.slo_ms:
+                met = 1e3 * histogram.percentile(self.slo_percentile) <= self.slo_ms[stage]
+                stages[stage].update(slo_ms=self.slo_ms[stage], slo_met=met)
+                slo_met = slo_met and met
+        return {'duration_s': round(time.time() - self.started, 3),
+                'slo_percentile': self.slo_percentile,
+                'slo_met': slo_met,
+                'stages': stages,
+                'counters': dict(self.counters),
+                'gauges': {name: {'last': last, 'max': peak} for name, (last, peak) in list(self.gauges.items())}}
+
+    def overlay_lines(self):
+        """Short text lines for an on-screen overlay: one per stage, then counters and gauges."""
+        lines = []
+        for stage, histogram in list(self.stages.items()):
+            s = histogram.summary()
+            lines.append(f"{stage:<12} p50 {s['p50_ms']:7.1f}  p95 {s['p95_ms']:7.1f}  p99 {s['p99_ms']:7.1f} ms")
+        counts = [f"{name} {n}" for name, n in list(self.counters.items())]
+        counts += [f"{name} {last} (max {peak})" for name, (last, peak) in list(self.gauges.items())]
+        if counts:
+            lines.append(" | ".join(counts))
+        return lines
+
+    def dump(self, path):
+        """Writes report() to `path` as JSON."""
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+            print(f"Latency report written to {path}")
+        except OSError as e:
+            print(f"Error writing latency report {path}: {e}")
@@ -0,0 +1,389 @@
+"""
+Pitch estimators behind one interface, so every script can swap backends and
+compare their cost.
+
+Every backend returns (times, f0, confidence), three float arrays with one
+entry per analysis frame:
+    times       frame centres in seconds from the start of the signal
+    f0          Hz, NaN where the backend itself decided the frame is unvoiced
+    confidence  0..1, how periodic / voiced the backend thinks the frame is
+
+estimate_many() analyses several signals in one batched pass (one difference
+function pass for yin, one multichannel pyin call per length, one model
+forward pass for crepe). Servers can use it to amortize per-call overhead.
+
+StreamingYin is the live counterpart of YinEstimator. It reads a RingBuffer,
+computes only the frames completed since its last update, and keeps a rolling
+median of the latest ones.
+"""
+import time
+from collections import deque
+
+import numpy as np
+import librosa
+
+
+def frame_signal(y, frame_length, hop_length):
+    """Centred, zero-padded frames as a (frame_length, n_frames) view, librosa's center=True grid."""
+    y = np.pad(y, frame_length // 2, mode='constant')
+    return librosa.util.frame(y, frame_length=frame_length, hop_length=hop_length)
+
+
+def cumulative_mean_normalized_difference(frames, min_period, max_period):
+    """YIN's d'(tau) for tau = min_period..max_period, one column per frame (as in librosa.yin)."""
+    frame_length = frames.shape[0]
+    # linear autocorrelation through a zero-padded FFT
+    spectrum = np.fft.rfft(frames, n=2 * frame_length, axis=0)
+    acf = np.fft.irfft(np.abs(spectrum) ** 2, axis=0)[:max_period + 1]
+
+    energy = np.cumsum(np.square(frames), axis=0)
+    diff = np.empty((max_period + 1, frames.shape[1]))
+    diff[0] = 0
+    diff[1:] = 2 * (acf[0:1] - acf[1:]) - energy[:max_period]
+
+    lags = np.arange(1, max_period + 1)[:, None]
+    cumulative_mean = np.cumsum(diff[1:], axis=0) / lags
+    denominator = cumulative_mean[min_period - 1:max_period]
+    return diff[min_period:] / (denominator + librosa.util.tiny(denominator))
+
+
+def parabolic_shifts(cmndf):
+    """Sub-bin offset of the parabola through each bin and its neighbours (0 at the edges)."""
+    shifts = np.zeros_like(cmndf)
+    left, mid, right = cmndf[:-2], cmndf[1:-1], cmndf[2:]
+    a = right + left - 2 * mid
+    b = (right - left) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shifts[1:-1] = np.where(np.abs(b) >= np.abs(a), 0, -b / a)
+    return shifts
+
+
+def yin_pick(cmndf, sr, min_period, trough_threshold=0.1):
+    """
+    Picks the period per frame like librosa.yin: the first trough below the
+    threshold, else the global minimum, refined by parabolic interpolation.
+
+    Returns:
+        tuple: (f0, confidence) with confidence = 1 - d'(period).
+    """
+    is_trough = librosa.util.localmin(cmndf, axis=0)
+    is_trough[0] = cmndf[0] < cmndf[1]
+    below = is_trough & (cmndf < trough_threshold)
+    period = np.where(below.any(axis=0), np.argmax(below, axis=0), np.argmin(cmndf, axis=0))
+
+    columns = np.arange(cmndf.shape[1])
+    shift = parabolic_shifts(cmndf)[period, columns]
+    f0 = sr / (min_period + period + shift)
+    confidence = np.clip(1 - cmndf[period, columns], 0, 1)
+    return f0, confidence
+
+
+class PitchEstimator:
+    """
+    Common interface of the pitch backends.
+
+    Subclasses implement estimate(); the default estimate_many() just loops
+    and should be overridden with a batched path where the backend has one.
+    """
+
+    name = None
+
+    def __init__(self, sr, fmin=180.0, fmax=3000.0):
+        self.sr = sr
+        self.fmin = fmin
+        self.fmax = fmax
+
+    def estimate(self, y):
+        """Returns (times, f0, confidence) for one mono signal."""
+        raise NotImplementedError
+
+    def estimate_many(self, signals):
+        """Returns one (times, f0, confidence) tuple per signal."""
+        return [self.estimate(y) for y in signals]
+
+
+class YinEstimator(PitchEstimator):
+    """librosa.yin-compatible YIN; f0 is never NaN, confidence is 1 - d'(period)."""
+
+    name = 'yin'
+
+    def __init__(self, sr, fmin=180.0, fmax=3000.0, frame_length=2048, hop_length=None,
+                 trough_threshold=0.1):
+        super().__init__(sr, fmin, fmax)
+        self.frame_length = frame_length
+        self.hop_length = hop_length or frame_length // 4
+        self.trough_threshold = trough_threshold
+        self.min_period = int(np.floor(sr / fmax))
+        self.max_period = min(int(np.ceil(sr / fmin)), frame_length - 1)
+
+    def estimate(self, y):
+        return self.estimate_many([y])[0]
+
+    def estimate_many(self, signals):
+        framed = [frame_signal(np.asarray(y, dtype=float), self.frame_length, self.hop_length)
+                  for y in signals]
+        if not framed:
+            return []
+        # one difference-function pass over the frames of every signal
+        cmndf = cumulative_mean_normalized_difference(np.concatenate(framed, axis=1),
+                                                      self.min_period, self.max_period)
+        f0, confidence = yin_pick(cmndf, self.sr, self.min_period, self.trough_threshold)
+
+        results = []
+        start = 0
+        for frames in framed:
+            stop = start + frames.shape[1]
+            times = librosa.frames_to_time(np.arange(frames.shape[1]), sr=self.sr,
+                                           hop_length=self.hop_length)
+            results.append((times, f0[start:stop], confidence[start:stop]))
+            start = stop
+        return results
+
+
+class PyinEstimator(PitchEstimator):
+    """librosa.pyin; f0 is NaN on unvoiced frames, confidence is the voicing probability."""
+
+    name = 'pyin'
+
+    def __init__(self, sr, fmin=180.0, fmax=3000.0, frame_length=2048, hop_length=None):
+        super().__init__(sr, fmin, fmax)
+        self.frame_length = frame_length
+        self.hop_length = hop_length or frame_length // 4
+
+    def _pyin(self, y):
+        f0, _, voiced_prob = librosa.pyin(y, fmin=self.fmin, fmax=self.fmax, sr=self.sr,
+                                          frame_length=self.frame_length,
+                                          hop_length=self.hop_length)
+        times = librosa.frames_to_time(np.arange(f0.shape[-1]), sr=self.sr,
+                                       hop_length=self.hop_length)
+        return times, f0, voiced_prob
+
+    def estimate(self, y):
+        return self._pyin(np.asarray(y, dtype=float))
+
+    def estimate_many(self, signals):
+        # pyin takes multichannel input, so equal-length signals share one call
+        results = [None] * len(signals)
+        by_length = {}
+        for i, y in enumerate(signals):
+            by_length.setdefault(len(y), []).append(i)
+        for indices in by_length.values():
+            times, f0, voiced_prob = self._pyin(
+                np.stack([np.asarray(signals[i], dtype=float) for i in indices]))
+            for row, i in enumerate(indices):
+                results[i] = (times, f0[row], voiced_prob[row])
+        return results
+
+
+class CrepeEstimator(PitchEstimator):
+    """
+    CREPE with the keras model loaded once per capacity ('tiny', 'small',
+    'medium', 'large', 'full'; smaller is faster and less accurate).
+    f0 is never NaN; confidence is the peak activation. fmin/fmax are unused,
+    the model covers C1..B7.
+
+    Every estimate()/estimate_many() call is one forward pass over all of
+    its 1024-sample frames, timed into `latencies` as (frames, seconds);
+    latency_summary() condenses them for picking capacity and step size.
+    Viterbi decoding only pays off over many consecutive frames. Leave it
+    off for short live windows.
+    """
+
+    name = 'crepe'
+    model_sr = 16000
+    frame_length = 1024
+    capacities = ('tiny', 'small', 'medium', 'large', 'full')
+
+    def __init__(self, sr, fmin=180.0, fmax=3000.0, model_capacity='full', step_size=10,
+                 viterbi=False, hop_length=None, latency_history=1000):
+        super().__init__(sr, fmin, fmax)
+        if model_capacity not in self.capacities:
+            raise ValueError(f"Unknown crepe capacity {model_capacity!r}, expected one of {self.capacities}")
+        import crepe  # optional: tensorflow is only needed for this backend
+        self._crepe = crepe
+        self.model_capacity = model_capacity
+        # hop_length (in input samples) is accepted for parity with the other backends
+        self.step_size = step_size if hop_length is None else 1000.0 * hop_length / sr
+        self.viterbi = viterbi
+        self.model = crepe.core.build_and_load_model(model_capacity)
+        self.latencies = deque(maxlen=latency_history)
+
+    def frames(self, y):
+        """Normalized 1024-sample model frames of y, the same as crepe.core.get_activation."""
+        y = np.asarray(y, dtype=np.float32)
+        if y.ndim == 2:
+            y = y.mean(axis=1)
+        if self.sr != self.model_sr:
+            from resampy import resample
+            y = resample(y, self.sr, self.model_sr)
+        y = np.pad(y, self.frame_length // 2, mode='constant')
+        hop_length = int(round(self.model_sr * self.step_size / 1000))
+        frames = librosa.util.frame(y, frame_length=self.frame_length, hop_length=hop_length).T.copy()
+        frames -= np.mean(frames, axis=1)[:, np.newaxis]
+        frames /= np.clip(np.std(frames, axis=1)[:, np.newaxis], 1e-8, None)
+        return frames
+
+    def decode(self, activation):
+        """(f0, confidence) from the model activation of consecutive frames."""
+        if self.viterbi:
+            cents = self._crepe.core.to_viterbi_cents(activation)
+        else:
+            cents = self._crepe.core.to_local_average_cents(activation)
+        f0 = 10 * 2 ** (cents / 1200)
+        f0[np.isnan(f0)] = 0
+        return f0, activation.max(axis=1)
+
+    def estimate(self, y):
+        return self.estimate_many([y])[0]
+
+    def predict(self, frames):
+        """Model activation of (n, 1024) normalized frames in one forward pass, timed."""
+        start = time.perf_counter()
+        activation = self.model.predict(frames, batch_size=max(1, len(frames)), verbose=0)
+        self.latencies.append((len(frames), time.perf_counter() - start))
+        return activation
+
+    def latency_summary(self):
+        """Per-batch latency over the recorded batches, in milliseconds."""
+        if not self.latencies:
+            return {'batches': 0}
+        frames = np.array([n for n, _ in self.latencies])
+        seconds = np.array([dt for _, dt in self.latencies])
+        return {'batches': len(seconds),
+                'mean_frames': float(frames.mean()),
+                'mean_ms': float(seconds.mean() * 1e3),
+                'p95_ms': float(np.percentile(seconds, 95) * 1e3),
+                'ms_per_frame': float(seconds.sum() / frames.sum() * 1e3)}
+
+    def estimate_many(self, signals):
+        framed = [self.frames(y) for y in signals]
+        if not framed:
+            return []
+        # a single forward pass over the frames of every signal
+        activation = self.predict(np.concatenate(framed))
+
+        results = []
+        start = 0
+        for frames in framed:
+            stop = start + len(frames)
+            f0, confidence = self.decode(activation[start:stop])
+            times = np.arange(len(frames)) * self.step_size / 1000.0
+            results.append((times, f0, confidence))
+            start = stop
+        return results
+
+
+class StreamingYin:
+    """
+    Incremental, causal YIN over a live RingBuffer.
+
+    Frame k covers the frame_length samples that end hop_length * k after the
+    first full frame. update() computes the frames completed since the last
+    call in one difference function pass, so each hop costs one frame no
+    matter how long the analysis runs. The last `median_frames` results are
+    kept for pitch(). Frames that would fall out of that history before they
+    are read (after the consumer stalled), or whose samples the buffer has
+    already overwritten, are skipped and never computed.
+    """
+
+    def __init__(self, sr, fmin=180.0, fmax=3000.0, frame_length=2048, hop_length=None,
+                 trough_threshold=0.1, median_frames=5):
+        self.sr = sr
+        self.frame_length = frame_length
+        self.hop_length = hop_length or frame_length // 4
+        self.trough_threshold = trough_threshold
+        self.min_period = int(np.floor(sr / fmax))
+        self.max_period = min(int(np.ceil(sr / fmin)), frame_length - 1)
+        self.median_frames = median_frames
+        self.reset()
+
+    def reset(self, position=0):
+        """Restarts the frame grid at absolute sample `position` and clears the history."""
+        self.next_end = position + self.frame_length  # end sample of the next frame
+        self.frame_count = 0
+        self._f0 = np.full(self.median_frames, np.nan)
+        self._confidence = np.zeros(self.median_frames)
+        self._frame = np.full(self.median_frames, -1)  # frame number held by each slot, -1 if none
+
+    def update(self, buffer, end=None):
+        """
+        Computes every frame that ends at or before `end` (default: everything
+        written to `buffer`) and has not been computed yet. Frames whose
+        samples were already overwritten are skipped, even if that is all of
+        them (an `end` older than the buffer holds), and so are frames the
+        producer overwrote while they were being analysed.
+
+        Returns:
+            tuple: (ends, f0, confidence) of the new frames; ends are absolute
+                sample positions.
+        """
+        requested = end
+        while True:
+            written = buffer.written
+            end = written if requested is None else min(requested, written)
+            if end < self.next_end:
+                return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+            n_new = (end - self.next_end) // self.hop_length + 1
+            # only the newest frames can still make it into the rolling history, and
+            # only frames still held by the buffer can be computed at all
+            oldest_end = written - buffer.capacity + self.frame_length
+            skip = max(n_new - self.median_frames,
+                       -(-(oldest_end - self.next_end) // self.hop_length), 0)
+            skip = min(skip, n_new)
+            self.frame_count += skip
+            self.next_end += skip * self.hop_length
+            n_new -= skip
+            if n_new == 0:
+                return np.empty(0, dtype=int), np.empty(0), np.empty(0)
+            last_end = self.next_end + (n_new - 1) * self.hop_length
+            try:
+                segment = buffer.window(last_end, self.frame_length + (n_new - 1) * self.hop_length)
+            except ValueError:
+                continue  # the producer overwrote it meanwhile; recount
+            break
+
+        frames = librosa.util.frame(np.asarray(segment, dtype=float),
+                                    frame_length=self.frame_length, hop_length=self.hop_length)
+        cmndf = cumulative_mean_normalized_difference(frames, self.min_period, self.max_period)
+        f0, confidence = yin_pick(cmndf, self.sr, self.min_period, self.trough_threshold)
+        ends = self.next_end + self.hop_length * np.arange(n_new)
+
+        # `segment` is a view into the live ring: frames whose start the producer
+        # overwrote while they were read are torn and dropped like skipped ones
+        torn = int(np.count_nonzero(ends - self.frame_length < buffer.written - buffer.capacity))
+        numbers = self.frame_count + np.arange(n_new)
+        slots = numbers[torn:] % self.median_frames
+        self._f0[slots] = f0[torn:]
+        self._confidence[slots] = confidence[torn:]
+        self._frame[slots] = numbers[torn:]
+        self.frame_count += n_new
+        self.next_end = last_end + self.hop_length
+        return ends[torn:], f0[torn:], confidence[torn:]
+
+    def pitch(self, min_confidence=0.0):
+        """
+        Rolling estimate over the last `median_frames` frames. Frames that
+        were skipped leave no result, so fewer frames (or none) may count.
+
+        Returns:
+            tuple: (median f0 in Hz, mean confidence) of the frames with at least
+                `min_confidence`; f0 is NaN if there are none.
+        """
+        recent = (self._frame >= 0) & (self._frame >= self.frame_count - self.median_frames)
+        kept = self._confidence[recent]
+        f0 = self._f0[recent][kept >= min_confidence]
+        if len(f0) == 0:
+            return np.nan, float(kept.mean()) if len(kept) else 0.0
+        return float(np.median(f0)), float(kept[kept >= min_confidence].mean())
+
+
+ESTIMATORS = {cls.name: cls for cls in (YinEstimator, PyinEstimator, CrepeEstimator)}
+
+
+def make_estimator(name, sr, **kwargs):
+    """Builds the backend registered under `name` ('yin', 'pyin', 'crepe')."""
+    try:
+        cls = ESTIMATORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown pitch estimator {name!r}, expected one of {sorted(ESTIMATORS)}")
+    return cls(sr, **kwargs)
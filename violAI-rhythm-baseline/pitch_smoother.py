@@ -0,0 +1,186 @@
+"""
+Fixed-lag online Viterbi smoothing of live pitch tracks.
+
+Per-window medians let single-frame octave errors and voicing flicker through
+as "wrong notes". FixedLagPitchSmoother runs a pitch HMM over the frames
+as they arrive. It accepts (f0, confidence) from any backend in
+pitch_estimators, and emits the most likely pitch of the frame `lag` frames
+back. The lag comes from a latency budget. Each frame costs one Viterbi step
+over the states plus a backtrack of `lag` steps, and the history is never
+re-decoded.
+
+Model:
+    states       pitch bins of 1/bins_per_semitone semitone between fmin and
+                 fmax, plus one unvoiced state
+    voiced step  moves at most max_step_cents, favouring small steps with a
+                 triangular kernel (vibrato, glides), or with probability
+                 jump_prob lands on any bin (a new note)
+    voicing      voiced <-> unvoiced with voicing_switch_prob; staying
+                 unvoiced costs the same as staying on a bin, as if the
+                 unvoiced state had a pitch copy per bin like pYIN's
+    emission     a Gaussian bump around the observed pitch, with octave_prob
+                 of the mass on the octaves above and below (octave errors),
+                 scaled by the confidence; the unvoiced state emits
+                 1 - confidence
+
+A one- or two-frame octave jump costs two "new note" transitions but only a
+little emission likelihood, so the decoded track stays put.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def hz_to_midi(f):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 69 + 12 * np.log2(np.asarray(f, dtype=float) / 440.0)
+
+
+def midi_to_hz(m):
+    return 440.0 * 2 ** ((np.asarray(m, dtype=float) - 69) / 12)
+
+
+class FixedLagPitchSmoother:
+    """
+    Online pitch HMM with fixed-lag Viterbi decoding.
+
+    Args:
+        hop_s (float): time between the frames pushed in.
+        latency_s (float): latency budget; the output trails the input by
+            lag = round(latency_s / hop_s) frames (see `delay`).
+    """
+
+    def __init__(self, fmin=180.0, fmax=3000.0, hop_s=0.01, latency_s=0.1, bins_per_semitone=5,
+                 max_step_cents=60.0, jump_prob=0.02, voicing_switch_prob=0.02, octave_prob=0.1,
+                 sigma_cents=30.0, floor=1e-4):
+        self.hop_s = hop_s
+        self.lag = max(0, int(round(latency_s / hop_s)))
+        self.bins_per_semitone = bins_per_semitone
+        self.midi_min = float(hz_to_midi(fmin))
+        n_bins = int(np.ceil((hz_to_midi(fmax) - self.midi_min) * bins_per_semitone)) + 1
+        self.bin_midi = self.midi_min + np.arange(n_bins) / bins_per_semitone
+        self.n_bins = n_bins
+        self.band = max(1, int(round(max_step_cents / 100 * bins_per_semitone)))
+        self.octave_prob = octave_prob
+        self.sigma = sigma_cents / 100.0
+        self.floor = floor
+
+        stay_voiced = 1 - voicing_switch_prob
+        kernel = self.band + 1 - np.abs(np.arange(-self.band, self.band + 1))
+        kernel = kernel / kernel.sum()
+        self.log_local = np.log(stay_voiced * (1 - jump_prob) * kernel)
+        self.log_jump = np.log(stay_voiced * jump_prob / n_bins)
+        self.log_to_unvoiced = np.log(voicing_switch_prob)
+        self.log_stay_unvoiced = np.log((1 - voicing_switch_prob) * (1 - jump_prob) * kernel.max())
+        self.log_to_voiced = np.log(voicing_switch_prob / n_bins)
+        self.reset()
+
+    @property
+    def delay(self):
+        """Seconds between a frame going in and its smoothed value coming out."""
+        return self.lag * self.hop_s
+
+    def reset(self):
+        self.frame_count = 0
+        self._delta = np.zeros(self.n_bins + 1)  # log score per state, last = unvoiced
+        # ring of the last lag + 1 frames: backpointers and raw observations
+        self._psi = np.zeros((self.lag + 1, self.n_bins + 1), dtype=np.intp)
+        self._observed = np.full(self.lag + 1, np.nan)
+        self._emitted = 0
+
+    def _log_emission(self, f0, confidence):
+        confidence = 0.0 if not np.isfinite(f0) or f0 <= 0 else float(np.clip(confidence, 0, 1))
+        voiced = np.full(self.n_bins, self.floor)
+        if confidence > 0:
+            d = hz_to_midi(f0) - self.bin_midi
+            bump = lambda x: np.exp(-0.5 * (x / self.sigma) ** 2)
+            voiced += confidence * ((1 - self.octave_prob) * bump(d)
+                                    + self.octave_prob / 2 * (bump(d - 12) + bump(d + 12)))
+        unvoiced = (1 - confidence) * (1 - self.octave_prob) + self.floor
+        return np.log(np.append(voiced, unvoiced))
+
+    def _step(self, log_emission):
+        voiced = self._delta[:-1]
+        unvoiced = self._delta[-1]
+        # best predecessor within the local band, vectorised over bins
+        window = sliding_window_view(np.pad(voiced, self.band, constant_values=-np.inf),
+                                     2 * self.band + 1)
+        weighted = window + self.log_local
+        local_arg = np.argmax(weighted, axis=1)
+        local_best = weighted[np.arange(self.n_bins), local_arg]
+        local_from = np.arange(self.n_bins) - self.band + local_arg
+        best_voiced = int(np.argmax(voiced))
+        jump_best = voiced[best_voiced] + self.log_jump
+        from_unvoiced = unvoiced + self.log_to_voiced
+
+        scores = np.stack([local_best, np.full(self.n_bins, jump_best),
+                           np.full(self.n_bins, from_unvoiced)])
+        choice = np.argmax(scores, axis=0)
+        psi = np.where(choice == 0, local_from, np.where(choice == 1, best_voiced, self.n_bins))
+        new_voiced = scores[choice, np.arange(self.n_bins)]
+
+        stay = unvoiced + self.log_stay_unvoiced
+        enter = voiced[best_voiced] + self.log_to_unvoiced
+        new_unvoiced, psi_unvoiced = (stay, self.n_bins) if stay >= enter else (enter, best_voiced)
+
+        delta = np.append(new_voiced, new_unvoiced) + log_emission
+        self._delta = delta - delta.max()  # keep the scores bounded
+        return np.append(psi, psi_unvoiced)
+
+    def _backtrack(self, frames_back):
+        """State of the frame `frames_back` before the newest one."""
+        state = int(np.argmax(self._delta))
+        newest = (self.frame_count - 1) % (self.lag + 1)
+        for k in range(frames_back):
+            state = self._psi[(newest - k) % (self.lag + 1), state]
+        return state
+
+    def _pitch(self, state, frame):
+        """Hz of a decoded state: the frame's own f0 moved to the state's octave, NaN if unvoiced."""
+        if state == self.n_bins:
+            return np.nan
+        observed = self._observed[frame % (self.lag + 1)]
+        target = self.bin_midi[state]
+        if np.isfinite(observed) and observed > 0:
+            midi = hz_to_midi(observed)
+            midi += 12 * np.round((target - midi) / 12)
+            if abs(midi - target) <= self.band / self.bins_per_semitone:
+                return float(midi_to_hz(midi))
+        return float(midi_to_hz(target))
+
+    def push(self, f0, confidence):
+        """
+        Adds one frame.
+
+        Returns:
+            tuple: (frame_index, f0_hz) of the frame `lag` frames back, f0 NaN
+                when unvoiced; None while the first `lag` frames fill up.
+        """
+        if self.frame_count == 0:
+            log_emission = self._log_emission(f0, confidence)
+            self._delta = log_emission - log_emission.max()
+            psi = np.full(self.n_bins + 1, self.n_bins)
+        else:
+            psi = self._step(self._log_emission(f0, confidence))
+        slot = self.frame_count % (self.lag + 1)
+        self._psi[slot] = psi
+        self._observed[slot] = f0
+        self.frame_count += 1
+        if self.frame_count <= self.lag:
+            return None
+        frame = self.frame_count - 1 - self.lag
+        self._emitted = frame + 1
+        return frame, self._pitch(self._backtrack(self.lag), frame)
+
+    def push_many(self, f0, confidence):
+        """push() over arrays; returns the (frame_index, f0_hz) outputs produced."""
+        outputs = (self.push(f, c) for f, c in zip(f0, confidence))
+        return [out for out in outputs if out is not None]
+
+    def flush(self):
+        """Decodes the frames still inside the lag (end of input)."""
+        outputs = []
+        for frame in range(self._emitted, self.frame_count):
+            state = self._backtrack(self.frame_count - 1 - frame)
+            outputs.append((frame, self._pitch(state, frame)))
+        self._emitted = self.frame_count
+        return outputs
@@ -1,120 +1,169 @@
 import os
 import time
-import threading
 import numpy as np
 import pygame
-import verovio
-import sounddevice as sd
 import pretty_midi
-import crepe
 from io import BytesIO
-from music21 import converter, tempo, note
-from music21.musicxml.m21ToXml import GeneralObjectExporter
-import subprocess
+from music21 import converter
 
-# ======== [1] 樂譜載入與音符時間計算 ========
-score = converter.parse("Four_Seasons_Spring_I_Violin.mxl")
-if not list(score.recurse().getElementsByClass(tempo.MetronomeMark)):
-    score.insert(0, tempo.MetronomeMark(number=120))
-bpm = score.recurse().getElementsByClass(tempo.MetronomeMark).first().number
-notes = list(score.flatten().notes)
-target_notes = []
-for i, n in enumerate(notes):
-    start = n.offset / bpm * 60
-    end = start + n.quarterLength / bpm * 60
-    pitch = int(n.pitch.midi)
-    name = n.pitch.nameWithOctave
-    target_notes.append({'start': start, 'end': end, 'pitch': pitch, 'note_name': name, 'id': f"n{i}"})
-    n.editorial.id = f"n{i}"
-
-detection_status = {note['id']: None for note in target_notes}
+from pitch_estimators import make_estimator
+from score_compiler import load_score
+from capture import MicrophoneSource
+from session import DetectionSession, QueueSink
+from score_render import PagedScoreRenderer, rasterize_svg
 
-# ======== [2] 音高偵測背景執行緒 ========
+# ======== [1] 樂譜載入與音符時間計算 ========
+SCORE_PATH = "Four_Seasons_Spring_I_Violin.mxl"
+# compiled once into columns and cached next to the score (.npz), so a restart reads
+# it back in milliseconds instead of parsing the MusicXML again; 120 BPM if it has no tempo
+score = load_score(SCORE_PATH, default_bpm=120)
+bpm = score.bpm
+# sorted columns of the notes (chords judged on their first pitch), ids n0, n1, ... in score order
+timeline = score.timeline()
+
+def load_notation():
+    """The music21 score for drawing, with the same ids as the timeline; parsed on the page prefetch thread."""
+    notation = converter.parse(SCORE_PATH)
+    for i, n in enumerate(notation.flatten().notes):
+        n.editorial.id = f"n{i}"
+        n.id = f"n{i}"  # exported to MusicXML, so it becomes the note's id in verovio's SVG
+    return notation
+
+# ======== [2] 音高偵測 (headless DetectionSession) ========
 SAMPLE_RATE = 16000
-FRAME_DURATION = 0.05
-FRAME_SIZE = int(SAMPLE_RATE * FRAME_DURATION)
+FRAME_DURATION = 0.05  # seconds per analysed frame, also the hop
 AMPLITUDE_THRESHOLD = 0.01
-
-def detection_loop(get_start_time):
-    while True:
-        audio = sd.rec(FRAME_SIZE, samplerate=SAMPLE_RATE, channels=1, dtype='float32')
-        sd.wait()
-        if np.max(np.abs(audio)) < AMPLITUDE_THRESHOLD:
-            continue
-        _, freq, conf, _ = crepe.predict(audio, SAMPLE_RATE, viterbi=True)
-        midi_number = pretty_midi.hz_to_note_number(freq[0])
-        t = time.time() - get_start_time()
-        for note in target_notes:
-            if note["start"] <= t <= note["end"]:
-                if detection_status[note["id"]] is None:
-                    correct = abs(midi_number - note["pitch"]) <= 0.5
-                    detection_status[note["id"]] = correct
-                    symbol = "✅" if correct else "❌"
-                    print(f"[{symbol}] t={t:.2f}s | Expected: {note['note_name']}, Got: {pretty_midi.note_number_to_name(midi_number)}")
-                break
+MAX_BATCH = 8  # backlog frames sent through crepe in one forward pass
+# model loaded once; 'tiny'..'full' and the step size trade accuracy for CPU.
+# Viterbi over a 50 ms frame has nothing to decode, so it stays off.
+CREPE_CAPACITY = 'full'
+CREPE_STEP_MS = 10
+pitch_estimator = make_estimator('crepe', SAMPLE_RATE, model_capacity=CREPE_CAPACITY,
+                                 step_size=CREPE_STEP_MS, viterbi=False)
+# per-stage latency (see latency.py), written to LATENCY_REPORT_PATH on exit
+LATENCY_SLO_MS = {'end_to_end': 250}  # p95 limits, checked in the report
+LATENCY_REPORT_PATH = "latency_report.json"
+SHOW_LATENCY_OVERLAY = False
+# notes are judged on the Viterbi-smoothed track, SMOOTHING_LATENCY behind the
+# newest frame, so a single octave slip or dropout no longer marks a wrong note
+SMOOTHING_LATENCY = 0.15
+# capture, crepe, smoothing and note judging all live in the session; this script
+# only draws its events. Every frame is analysed (no max lag): a backlog catches up in batches
+events = QueueSink()
+session = DetectionSession(MicrophoneSource(SAMPLE_RATE), timeline, sinks=[events], samplerate=SAMPLE_RATE,
+                           backend='crepe', estimator=pitch_estimator, window_s=FRAME_DURATION,
+                           hop_s=FRAME_DURATION, max_batch=MAX_BATCH, max_lag_s=None, bandpass=None,
+                           amplitude_threshold=AMPLITUDE_THRESHOLD, smoothing_latency=SMOOTHING_LATENCY,
+                           slo_ms=LATENCY_SLO_MS)
+latency = session.latency
 
 # ======== [3] Verovio + Pygame 初始化 ========
-tk = verovio.toolkit()
-tk.setOptions({"scale": 40, "adjustPageHeight": True})
-exporter = GeneralObjectExporter()
+MISSED_COLOR = "#d64848"
+PLAYING_COLOR = "#6ca6d6"
 pygame.init()
 pygame.mixer.init()
 screen_width, screen_height = 1200, 800
 screen = pygame.display.set_mode((screen_width, screen_height))
 pygame.display.set_caption("Real-time Score Display")
+overlay_font = pygame.font.SysFont(None, 22)
+
+# the score is laid out in 4-measure pages, each once, on a background thread that
+# keeps the pages ahead of the playhead ready; status changes only recolor notes in the SVG
+pages = PagedScoreRenderer(load_notation, bpm, measures_per_page=4, viewport=(screen_width, screen_height),
+                           measures=score.measures())
+
+def draw_page(page):
+    """Page -> pygame surface fitted to the window and its top-left corner. Pages with no
+    colored notes use the prefetched raster, so a page turn doesn't rasterize."""
+    colors = {note_id: note_colors[note_id] for note_id in page.svg.ids if note_id in note_colors}
+    png_bytes = rasterize_svg(page.svg.recolor(colors), (screen_width, screen_height)) if colors else page.png
+    image = pygame.image.load(BytesIO(png_bytes)).convert_alpha()
+    image_width, image_height = image.get_size()
+    return image, ((screen_width - image_width) // 2, (screen_height - image_height) // 2)
 
 # ======== [4] 播放 MIDI 並啟動時間基準 ========
 midi_path = "temp.mid"
-score.write("midi", fp=midi_path)
+score.to_stream().write("midi", fp=midi_path)  # no notation needed for playback
 pygame.mixer.music.load(midi_path)
+# 啟動偵測 (the session runs its own analysis thread)
+session.start()
 start_time = time.time()
 #pygame.mixer.music.play()
 
-# 啟動偵測執行緒
-threading.Thread(target=detection_loop, args=(lambda: start_time,), daemon=True).start()
-
 # ======== [5] 每幀渲染並顯示 ========
+render_cursor = timeline.cursor()
+note_colors = {}  # note id -> color currently drawn
+playing = None  # id of the note drawn in PLAYING_COLOR
+shown = pages.wait_for(0)
+image, position = draw_page(shown)
+overlay = []  # rendered latency lines, refreshed twice a second
+overlay_updated = 0.0
+clock = pygame.time.Clock()
 running = True
 while running:
     now = time.time() - start_time  # ✅ 改為真實時間
-
-    for n in notes:
-        n.style.color = None
-    for note in target_notes:
-        match_note = next((n for n in notes if n.editorial.id == note["id"]), None)
-        if not match_note:
+    frame_start = latency.now()
+    changed = False
+    heard_times = []  # detections that show up on screen this frame
+
+    # 染色邏輯: wrong notes and notes that ended unplayed (錯過未演奏視為錯誤) stay red,
+    # the current note is blue while correct
+    for event in events.drain():
+        if event['type'] != 'note':
             continue
-
-        if now > note["end"] and detection_status[note["id"]] is None:
-            detection_status[note["id"]] = False  # 錯過未演奏視為錯誤
-
-        # 染色邏輯
-        if detection_status[note["id"]] is False:
-            match_note.style.color = "#d64848"
-        elif note["start"] <= now <= note["end"] and detection_status[note["id"]] is True:
-            match_note.style.color = "#6ca6d6"
-
-    xml = exporter.parse(score).decode("utf-8")
-    tk.loadData(xml)
-    svg = tk.renderToSVG(1)
-
-    proc = subprocess.Popen(["rsvg-convert", "-f", "png"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    png_bytes, _ = proc.communicate(svg.encode("utf-8"))
-    image = pygame.image.load(BytesIO(png_bytes)).convert_alpha()
-    image_width, image_height = image.get_size()
+        if not event['missed']:
+            heard_times.append(event['heard_at'])
+            symbol = "✅" if event['correct'] else "❌"
+            got = pretty_midi.note_number_to_name(pretty_midi.hz_to_note_number(event['pitch_hz']))
+            print(f"[{symbol}] t={event['time']:.2f}s | Expected: {timeline.names[event['index']]}, Got: {got}")
+        if not event['correct']:
+            note_colors[event['id']] = MISSED_COLOR
+            changed = True
+    current = render_cursor.at(now)
+    current_id = timeline.ids[current] if current >= 0 and session.status[timeline.ids[current]] is True else None
+    if current_id != playing:
+        if playing is not None and note_colors.get(playing) == PLAYING_COLOR:
+            del note_colors[playing]
+        if current_id is not None:
+            note_colors[current_id] = PLAYING_COLOR
+        playing = current_id
+        changed = True
+
+    # 翻頁: switch once the prefetch thread has the page, never wait for it here
+    index = pages.follow(now)
+    if index != shown.index and pages.page(index) is not None:
+        shown = pages.page(index)
+        changed = True
+
+    if changed:
+        image, position = draw_page(shown)
 
     screen.fill((255, 255, 255))
-    scale = min(screen_width / image_width, screen_height / image_height)
-    new_size = (int(image_width * scale), int(image_height * scale))
-    image = pygame.transform.smoothscale(image, new_size)
-    x = (screen_width - new_size[0]) // 2
-    y = (screen_height - new_size[1]) // 2
-    screen.blit(image, (x, y))
+    screen.blit(image, position)
+    if SHOW_LATENCY_OVERLAY:
+        if now - overlay_updated >= 0.5:
+            overlay = [overlay_font.render(line, True, (0, 0, 0)) for line in latency.overlay_lines()]
+            overlay_updated = now
+        for k, line in enumerate(overlay):
+            screen.blit(line, (10, 10 + 20 * k))
     pygame.display.flip()
+    shown_at = latency.since('ui', frame_start)
+    for heard in heard_times:
+        latency.record('end_to_end', shown_at - heard)  # audio in -> note colored on screen
 
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
+    clock.tick(30)
 
+pages.close()
+session.stop()
+session.source.close()
 pygame.quit()
+reader = session.reader
+print(f"Capture: {session.dropouts} dropouts, {reader.overruns} overruns, {reader.skipped} frames skipped")
+print(f"crepe {CREPE_CAPACITY}, {CREPE_STEP_MS} ms step: {pitch_estimator.latency_summary()}")
+latency.count('overruns', reader.overruns)
+latency.count('skipped_frames', reader.skipped)
+latency.dump(LATENCY_REPORT_PATH)
 print("✅ 播放完成")
\ No newline at end of file
@@ -1,61 +1,27 @@
 import sys, time
 import numpy as np
-import sounddevice as sd
-import librosa
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from collections import deque
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QGridLayout
-from PyQt5.QtCore import Qt, QThread
-from scipy import signal
+from PyQt5.QtCore import Qt, QTimer
 import music21
 
+from score_compiler import load_score as compile_score
 from score_viewer import ScoreViewer
 from graph_rhythm import GraphRhythm
+from capture import MicrophoneSource
+from session import DetectionSession, QueueSink
 
 # === 樂譜與節奏資料分析 ===
 def load_score(score_path):
     try:
-        stream = music21.converter.parse(score_path)
-        excerpt = stream.measures(1, 4)
+        compiled = compile_score(score_path)  # parsed once, then read back from its .npz cache
         print(f"✅ Successfully loaded score from: {score_path}")
-        return excerpt
+        return compiled
     except Exception as e:
         print(f"❌ Error loading score: {e}")
         return None
 
-def analyze_music21_stream(stream_obj, default_bpm=60):
-    flat_score = stream_obj.flatten().notesAndRests
-    bpm = default_bpm
-    for m in stream_obj.recurse().getElementsByClass('MetronomeMark'):
-        bpm = m.number
-        break
-    bps = bpm / 60.0
-    result = []
-    for elem in flat_score:
-        start = elem.offset / bps
-        end = (elem.offset + elem.quarterLength) / bps
-        if isinstance(elem, music21.note.Note):
-            result.append({'start_time_s': start, 'end_time_s': end,
-                           'note': [elem.nameWithOctave], 'frequency': [elem.pitch.frequency]})
-        elif isinstance(elem, music21.note.Rest):
-            result.append({'start_time_s': start, 'end_time_s': end,
-                           'note': ['Rest'], 'frequency': None})
-    return result
-
-# === 音高偵測背景執行緒 ===
-class PitchDetectThread(QThread):
-    def __init__(self, detector):
-        super().__init__()
-        self.detector = detector
-        self._running = True
-
-    def run(self):
-        self.detector.pitch_detect_loop(self)
-
-    def stop(self):
-        self._running = False
-
 # === 主介面應用 ===
 class PitchDetector(QWidget):
     def __init__(self):
@@ -64,8 +30,8 @@ class PitchDetector(QWidget):
         self.resize(400, 200)
 
         self.score_path = 'The_Happy_Farmer.mxl'
-        self.score_stream = load_score(self.score_path)
-        self.score_data = analyze_music21_stream(self.score_stream)
+        self.score = load_score(self.score_path)
+        self.score_data = self.score.score_data()
 
         # UI Layout
         self.layout = QGridLayout()
@@ -73,7 +39,9 @@ class PitchDetector(QWidget):
 
         self.pitch_label = QLabel("Pitch: N/A")
         self.time_label = QLabel("Time Elapsed: 0.0s")
-        self.score_label = ScoreViewer(self.score_stream)
+        # the notation is only parsed for drawing, on the viewer's render thread
+        self.score_label = ScoreViewer(lambda: music21.converter.parse(self.score_path),
+                                       bpm=self.score.bpm, measures=self.score.measures())
         self.start_button = QPushButton("Start")
         self.stop_button = QPushButton("Stop")
 
@@ -89,15 +57,25 @@ class PitchDetector(QWidget):
         # Audio config
         self.samplerate = 44100
         self.blocksize = 1024
-        self.audio_buffer = deque(maxlen=int(self.samplerate * 2))
         self.analysis_window_size = 0.05
+        self.analysis_hop = 0.01  # seconds between analyses, counted in captured samples
+        self.analysis_max_lag = 0.1  # seconds of backlog before stale hops are dropped
         self.lowcut = 180.0
         self.highcut = 3000.0
-        self.b, self.a = signal.butter(4, [self.lowcut, self.highcut], btype='band', fs=self.samplerate)
-        self.stream = sd.InputStream(samplerate=self.samplerate, channels=1, callback=self.audio_callback)
-
-        self.pitches_played = []
-        self.thread = None
+        self.pitch_backend = 'yin'  # 'yin', 'pyin' or 'crepe'
+        # fixed-lag Viterbi over the per-hop pitches, reported smoothing_latency late
+        self.smoothing_latency = 0.08
+        # the session does capture, filtering and pitch tracking; this widget only draws
+        self.events = QueueSink()
+        self.session = DetectionSession(MicrophoneSource(self.samplerate, self.blocksize), sinks=[self.events],
+                                        samplerate=self.samplerate, backend=self.pitch_backend,
+                                        window_s=self.analysis_window_size, hop_s=self.analysis_hop,
+                                        max_lag_s=self.analysis_max_lag, bandpass=(self.lowcut, self.highcut),
+                                        smoothing_latency=self.smoothing_latency,
+                                        fmin=self.lowcut, fmax=self.highcut)
+        self.event_timer = QTimer(self)
+        self.event_timer.setInterval(20)
+        self.event_timer.timeout.connect(self.show_events)
         self.start_time = None
 
         # Timeline figure (overlay with moving line + pitch trace)
@@ -111,19 +89,10 @@ class PitchDetector(QWidget):
         self.detected_dots, = self.ax_overlay.plot([], [], 'bo', markersize=4)
 
         # === 加入樂譜背景軌道圖 ===
-        from music21 import converter, note, chord
-
-        score = converter.parse("The_Happy_Farmer.mxl")
-        violin_part = score.parts[0]
-        first_measures = violin_part.measures(1, 4)
-
-        notes_data = []
-        for elem in first_measures.flat.notes:
-            if isinstance(elem, note.Note):
-                notes_data.append((elem.offset, elem.pitch.midi, elem.quarterLength))
-            elif isinstance(elem, chord.Chord):
-                for p in elem.pitches:
-                    notes_data.append((elem.offset, p.midi, elem.quarterLength))
+        rows = self.score.measure_rows(1, 4) & (self.score.chord_size > 0)
+        origin = self.score.measure_start(1)
+        notes_data = list(zip(self.score.start_beats[rows] - origin, self.score.midi[rows],
+                              self.score.end_beats[rows] - self.score.start_beats[rows]))
 
         space_ratio = 0.95
         adjusted_notes_data = [(start, pitch, duration * space_ratio)
@@ -140,41 +109,22 @@ class PitchDetector(QWidget):
         plt.tight_layout()
         plt.show(block=False)
 
-    def audio_callback(self, indata, frames, time_info, status):
-        if status:
-            print("⚠️ Audio status:", status)
-        self.audio_buffer.extend(indata[:, 0])
-
-    def pitch_detect_loop(self, thread):
-        self.start_time = time.time()
-        self.stream.start()
-        try:
-            while thread._running:
-                if len(self.audio_buffer) < int(self.samplerate * self.analysis_window_size):
-                    continue
-                raw_audio = np.array(list(self.audio_buffer)[-int(self.samplerate * self.analysis_window_size):])
-                filtered = signal.filtfilt(self.b, self.a, raw_audio)
-
-                f0 = librosa.yin(filtered, sr=self.samplerate,
-                                 fmin=self.lowcut, fmax=self.highcut,
-                                 frame_length=2048, hop_length=int(self.samplerate * 0.01))
-                f0_valid = f0[~np.isnan(f0)]
-                if len(f0_valid) > 0:
-                    pitch_hz = np.median(f0_valid)
-                    pitch_midi = 69 + 12 * np.log2(pitch_hz / 440.0)
-                    note_name = librosa.hz_to_note(pitch_hz)
-                    t = round(time.time() - self.start_time, 2)
-
-                    self.pitch_label.setText(f"Pitch: {note_name} ({pitch_hz:.2f} Hz)")
-                    self.time_label.setText(f"Time Elapsed: {t:.2f}s")
-                    self.pitches_played.append({'note': note_name, 'pitch': pitch_hz, 'time': t})
-
-                    self.timeline_times.append(t)
-                    self.timeline_pitches.append(pitch_midi)
-        except Exception as e:
-            print(f"❌ Error in pitch detection loop: {e}")
-        finally:
-            self.stream.stop()
+    def show_events(self):
+        """Draws the pitches the session reported since the last tick (GUI thread)."""
+        pitches = [event for event in self.events.drain() if event['type'] == 'pitch']
+        if not pitches:
+            return
+        self.score_label.set_playhead(pitches[-1]['time'])
+        for event in pitches:
+            if np.isnan(event['pitch_hz']):
+                continue
+            self.timeline_times.append(round(event['time'], 2))
+            self.timeline_pitches.append(69 + 12 * np.log2(event['pitch_hz'] / 440.0))
+        voiced = [event for event in pitches if not np.isnan(event['pitch_hz'])]
+        if voiced:
+            event = voiced[-1]
+            self.pitch_label.setText(f"Pitch: {event['note_name']} ({event['pitch_hz']:.2f} Hz)")
+            self.time_label.setText(f"Time Elapsed: {event['time']:.2f}s")
 
     def update_timeline(self, frame):
         if not self.timeline_times:
@@ -186,21 +136,22 @@ class PitchDetector(QWidget):
             self.ax_overlay.set_xlim(now - 10, now + 2)
 
     def start(self):
-        if self.thread is None or not self.thread.isRunning():
-            self.thread = PitchDetectThread(self)
-            self.thread.start()
+        if not self.session.running:
+            self.start_time = time.time()
+            self.session.start()
+            self.event_timer.start()
             print("🎙️ Audio started...")
 
     def stop(self):
-        if self.thread and self.thread.isRunning():
-            self.thread.stop()
-            self.thread.wait()
-        self.stream.stop()
+        if not self.session.running:
+            return
+        self.session.stop()
+        self.event_timer.stop()
         print("🛑 Audio stopped.")
         if hasattr(self, 'rhythm_graph'):
             self.layout.removeWidget(self.rhythm_graph)
             self.rhythm_graph.deleteLater()
-        self.rhythm_graph = GraphRhythm(self, score_data=self.score_data, pitches_played=self.pitches_played)
+        self.rhythm_graph = GraphRhythm(self, score_data=self.score_data, pitches_played=self.session.pitches_played)
         self.layout.addWidget(self.rhythm_graph)
 
 if __name__ == "__main__":
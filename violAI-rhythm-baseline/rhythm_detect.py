@@ -6,9 +6,9 @@ from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import QThread
 
 from music21 import converter, midi, tempo, note, meter
-import verovio
-import cairosvg
-from music21.musicxml.m21ToXml import GeneralObjectExporter
+from score_compiler import load_score
+from score_render import ScoreRenderer, to_musicxml
+from latency import LatencyMonitor
 
 import sounddevice as sd
 import scipy.io.wavfile as wav
@@ -40,9 +40,15 @@ class ScoreViewer(QWidget):
     def __init__(self):
         super().__init__()
         self.fname = ""
+        self.score = None # CompiledScore of fname: timings and pitches without re-parsing
         self.chunck_size = 4 # number of measures
         self.bp_measure = 4 # (default) top number of time signature
         self.tempo = 120 # (default)
+        self.renderer = ScoreRenderer(scale=40) # in-memory render + LRU of rasterized pages
+        # per-stage latency (see latency.py), written after each recording is analysed
+        self.latency = LatencyMonitor()
+        self.latency_report_path = 'latency_report.json'
+        self.show_latency_overlay = False
         
         #GUI
         self.setWindowTitle("Music21 + Verovio Score Viewer")
@@ -68,6 +74,9 @@ class ScoreViewer(QWidget):
         # plot for errors
         self.graph = MplCanvas(self, width=5, height=4, dpi=100)
         layout.addWidget(self.graph, 6, 0)
+        self.latency_label = QLabel("")
+        self.latency_label.setVisible(self.show_latency_overlay)
+        layout.addWidget(self.latency_label, 7, 0)
         
         layout.addWidget(self.open_file_button, 0, 0)
         layout.addWidget(self.label, 1, 0)
@@ -96,8 +105,8 @@ class ScoreViewer(QWidget):
     def get_measures(self):
         if self.fname != "":
             section = 1 # TODO: change to make dynamic later on
-            self.score = converter.parse(self.fname)
-            excerpt = self.score.measures(section, section + self.chunck_size - 1)
+            # a plain stream rebuilt from the compiled columns: enough for playback and MIDI
+            excerpt = self.score.to_stream(section, section + self.chunck_size - 1)
             #self.bp_measure = self.score.measure(1).getElementsByClass(meter.TimeSignature)[0].numerator #todo: debug index error
             #self.tempo = self.score.measusre(1).getElementsByClass(tempo.MetronomeMark)[0].number # just take the first tempo...
             #print(f"Tempo: {self.tempo} BPM, Time Signature: {self.bp_measure}/4")
@@ -110,24 +119,20 @@ class ScoreViewer(QWidget):
     def open_file(self):
         fname, _ = QFileDialog.getOpenFileName(self, "Open MXL File", "", "MXL Files (*.mxl)")
         if fname:
-            self.fname = fname
             try:
-                excerpt = self.get_measures()
-                
-                vrv_toolkit = verovio.toolkit()
-                exporter = GeneralObjectExporter()
-                xml_data = exporter.parse(excerpt).decode("utf-8")
-                vrv_toolkit.loadData(xml_data)
-                vrv_toolkit.setOptions({"scale": 40, "adjustPageHeight": True})
-                svg_data = vrv_toolkit.renderToSVG(1)
-                
-                svg_filepath = "temp_excerpt.svg"
-                with open(svg_filepath, "w") as f:
-                    f.write(svg_data)
-                png_filepath = "temp_excerpt.png"
-                cairosvg.svg2png(url=svg_filepath, write_to=png_filepath)
-                pixmap = QPixmap(png_filepath)
+                self.score = load_score(fname) # parsed once per file content, then read from its .npz
+                self.fname = fname
+                section = 1 # same excerpt as get_measures()
+                measures = (section, section + self.chunck_size - 1)
+                start = self.latency.now()
+                # a cached page skips parsing the file altogether; the score hash is the file's sha256
+                png_data = self.renderer.render(self.score.source_hash, measures,
+                                                lambda: to_musicxml(converter.parse(fname).measures(*measures)))
+                start = self.latency.since('score_render', start)
+                pixmap = QPixmap()
+                pixmap.loadFromData(png_data, "PNG")
                 self.label.setPixmap(pixmap)
+                self.latency.since('ui', start)
             except Exception as e:
                 self.label.setText(f"Error: {e}")
                 
@@ -199,22 +204,33 @@ class ScoreViewer(QWidget):
         
         try:
             print(f"Recording audio for {duration} seconds...")
+            start = self.latency.now()
             # Start the recording
             recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)  # channels=1 for mono
             sd.wait()  # Wait until the recording is finished
             print("Finished recording.")
+            # time past the requested duration: stream start-up and device latency
+            stage = self.latency.now()
+            self.latency.record('capture', stage - start - duration)
+            recorded = stage
 
             # Save the recording as a .wav file
             print(f"Saving audio to {filename}...")
             wav.write(filename, fs, recording)
             print("Audio saved successfully.")
+            stage = self.latency.since('save', stage)
 
         except Exception as e:
             print(f"An error occurred: {e}")
             return None  # Explicitly return None on error
         
         beat_times = self.analyze_rhythm(filename)
+        stage = self.latency.since('beat_tracking', stage)
         self.plot_rhythm(beat_times)
+        self.latency.since('ui', stage)
+        self.latency.record('end_to_end', self.latency.now() - recorded) # last sample recorded -> plot drawn
+        self.latency_label.setText("\n".join(self.latency.overlay_lines()))
+        self.latency.dump(self.latency_report_path)
         print(beat_times)
         
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Single-producer / single-consumer ring buffer for audio samples (float32
+    unless `dtype` says otherwise).
+
+    The audio callback write()s each block with one vectorized copy, and the
+    detection thread reads the most recent samples with latest(), which is a
+    zero-copy view. Every sample is stored twice, at i and i + capacity, so
+    any window of up to `capacity` samples is contiguous in memory.
+
+    A view stays valid until the producer has written `capacity - n` more
+    samples. Copy it (latest(n).copy()) to hold on to it longer.
+
+    Consumers don't need to poll. wait_until() sleeps until the producer has
+    written up to a given sample position, and window() then reads exactly the
+    samples that end there.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self._data = np.zeros(2 * self.capacity, dtype=dtype)
+        self._written = 0  # total samples ever written; only the producer updates it
+        self._ready = threading.Condition()
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    @property
+    def written(self):
+        """Total number of samples written so far (monotonic)."""
+        return self._written
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=self._data.dtype).ravel()
+        skipped = 0  # samples of an oversized block that would be overwritten at once
+        if len(samples) > self.capacity:
+            skipped = len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        n = len(samples)
+        start = (self._written + skipped) % self.capacity
+        first = min(n, self.capacity - start)
+        # primary copy at [start, start + n) wrapped, mirror copy one capacity later
+        self._data[start:start + first] = samples[:first]
+        self._data[start + self.capacity:start + self.capacity + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._data[self.capacity:self.capacity + n - first] = samples[first:]
+        # publish only after the data is in place
+        with self._ready:
+            self._written += skipped + n
+            self._ready.notify_all()
+
+    def wait_until(self, position, timeout=None):
+        """
+        Blocks until at least `position` samples have been written in total.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._ready:
+            return self._ready.wait_for(lambda: self._written >= position, timeout)
+
+    def latest(self, n):
+        """View of the newest n samples (fewer if fewer were written so far)."""
+        n = min(int(n), len(self))
+        end = self._written % self.capacity + self.capacity
+        return self._data[end - n:end]
+
+    def window(self, end, n):
+        """
+        View of the n samples ending at absolute sample position `end`.
+
+        Raises:
+            ValueError: if those samples were not written yet or were already
+                overwritten.
+        """
+        n = int(n)
+        if end > self._written or end - n < self._written - self.capacity or n > end:
+            raise ValueError(f"samples [{end - n}, {end}) are not in the buffer "
+                             f"(written {self._written}, capacity {self.capacity})")
+        stop = end % self.capacity + self.capacity
+        return self._data[stop - n:stop]
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    RingBuffer in multiprocessing shared memory, for a producer and a consumer
+    in different processes.
+
+    The samples and the `written` counter live in one shared block. Each
+    process maps the same pages, so nothing is pickled or copied on the way
+    (window() and latest() are still views). The counter is published under a
+    process-shared Condition, which orders it after the data and lets
+    wait_until() sleep instead of polling.
+
+    Create it in the producer's process and pass it to the consumer process as
+    a Process argument; only the block's name travels, and the child attaches
+    to it. The creator calls close() at the end, which also unlinks the block.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        size = 8 + 2 * self.capacity * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner = True
+        self._ready = multiprocessing.get_context('spawn').Condition()
+        self._attach()
+        self._header[0] = 0
+        self._data[:] = 0
+
+    def _attach(self):
+        self._header = np.ndarray(1, dtype=np.int64, buffer=self._shm.buf)
+        self._data = np.ndarray(2 * self.capacity, dtype=self.dtype, buffer=self._shm.buf, offset=8)
+
+    @property
+    def _written(self):
+        return int(self._header[0])
+
+    @_written.setter
+    def _written(self, value):
+        self._header[0] = value
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __getstate__(self):
+        # the Condition can only be pickled while spawning a process, which is the only supported hand-off
+        return {'name': self._shm.name, 'capacity': self.capacity, 'dtype': self.dtype.str, 'ready': self._ready}
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self.dtype = np.dtype(state['dtype'])
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._ready = state['ready']
+        self._attach()
+
+    def close(self):
+        """Unmaps the block; the creating process also frees it."""
+        self._header = self._data = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
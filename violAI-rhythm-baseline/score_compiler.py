@@ -0,0 +1,276 @@
+"""
+Compiled scores: a music21 parse turned into columns, cached next to the file.
+
+music21.converter.parse takes around half a second even on a one-page .mxl,
+and the front-ends parsed (and walked) the same file again and again: for the
+timeline, the graph, the background bars and each play press. load_score()
+parses once and keeps what the detectors need as numpy columns, one row per
+sounding pitch (a chord gives one row per member, a rest one row):
+
+    start_beats, end_beats   offsets in quarter notes (flattened score)
+    start_s, end_s           the same in seconds at `bpm`
+    midi, frequency          MIDI number and Hz (NaN for rests)
+    measure                  measure number (0 for a pickup)
+    event                    index of the note/chord/rest element; rows that
+                             share it belong to one chord
+    chord_size               pitches in the element (0 for a rest)
+    ids                      'n<k>' for the k-th note or chord, the same
+                             numbering realtime_detect.py gives the music21
+                             notes (and so verovio's SVG), 'r<k>' for rests
+    names                    'A4', 'Rest'
+
+plus the first part's measure table (measure_numbers, measure_starts in
+beats) for page layout, and the first metronome mark (NaN if none).
+
+load_score() keeps the result in a hidden .npz beside the score, named
+after the file and the sha256 of its bytes (`.<name>.<hash16>.npz`), so an
+edited score is recompiled and its stale entry removed, and a renamed or
+copied score is compiled again under its new name. If the score's folder
+isn't writable, the entry goes to ~/.cache/violai/scores, named by the hash
+alone. A hit costs a hash plus one np.load, a few milliseconds.
+
+Rendering still needs the notation itself (clefs, beams, ...), so the music21
+stream is parsed only where pages are drawn, and lazily.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+# bump whenever compile_stream() changes what it stores
+COMPILED_VERSION = 1
+FALLBACK_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'violai', 'scores')
+ROW_COLUMNS = ('start_beats', 'end_beats', 'midi', 'frequency', 'measure', 'event', 'chord_size', 'ids', 'names')
+
+
+def score_content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompiledScore:
+    """
+    Columnar view of a score; see the module docstring for the columns.
+
+    Args:
+        default_bpm (float): tempo for start_s/end_s when the score has no
+            metronome mark.
+    """
+
+    def __init__(self, columns, measure_numbers, measure_starts, tempo_bpm, default_bpm=60, source_hash=''):
+        for name in ROW_COLUMNS:
+            setattr(self, name, columns[name])
+        self.measure_numbers = measure_numbers
+        self.measure_starts = measure_starts
+        self.tempo_bpm = float(tempo_bpm)
+        self.source_hash = source_hash
+        self.bpm = self.tempo_bpm if np.isfinite(self.tempo_bpm) and self.tempo_bpm > 0 else float(default_bpm)
+        self.start_s = self.start_beats * 60.0 / self.bpm
+        self.end_s = self.end_beats * 60.0 / self.bpm
+
+    def __len__(self):
+        return len(self.start_beats)
+
+    # === Persistence ===
+
+    def save(self, path):
+        """Writes the columns to `path` (.npz), atomically."""
+        arrays = {name: getattr(self, name) for name in ROW_COLUMNS}
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, version=COMPILED_VERSION, source_hash=self.source_hash, tempo_bpm=self.tempo_bpm,
+                         measure_numbers=self.measure_numbers, measure_starts=self.measure_starts, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, default_bpm=60):
+        """
+        Returns:
+            CompiledScore: None if the file is missing, unreadable or from
+                another COMPILED_VERSION.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != COMPILED_VERSION:
+                    return None
+                columns = {name: data[name] for name in ROW_COLUMNS}
+                return cls(columns, data['measure_numbers'], data['measure_starts'], data['tempo_bpm'],
+                           default_bpm=default_bpm, source_hash=str(data['source_hash']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # === Views for the consumers ===
+
+    def events(self):
+        """Row index of the first member of each element, in score order."""
+        return np.flatnonzero(np.r_[True, self.event[1:] != self.event[:-1]]) if len(self) else np.empty(0, int)
+
+    def top_rows(self):
+        """Row of the highest pitch of each element (the row itself for single notes and rests)."""
+        first = self.events()
+        if not len(first):
+            return first
+        midi = np.where(np.isnan(self.midi), -np.inf, self.midi)
+        top = np.maximum.reduceat(midi, first)
+        rows = np.flatnonzero(midi == np.repeat(top, np.diff(np.r_[first, len(self)])))
+        # lowest row per element when a pitch is doubled
+        return rows[np.r_[True, self.event[rows[1:]] != self.event[rows[:-1]]]]
+
+    def timeline(self, rests=False):
+        """
+        ScoreTimeline with one event per note/chord (and rest, if asked).
+        A chord is judged on its first member; its name is the list of members.
+        """
+        from score_timeline import ScoreTimeline
+        first = self.events()
+        if not rests:
+            first = first[self.chord_size[first] > 0]
+        names = []
+        for start in first:
+            members = [str(name) for name in self.names[start:start + max(int(self.chord_size[start]), 1)]]
+            names.append(members[0] if len(members) == 1 else members)
+        return ScoreTimeline(self.start_s[first], self.end_s[first], self.midi[first],
+                             [str(i) for i in self.ids[first]], names=names)
+
+    def score_data(self):
+        """
+        One dict per element like detection.py used to build from the stream:
+        'start_time_s', 'end_time_s', 'note' (names, ['Rest'] for rests) and
+        'frequency' (Hz list, None for rests). GraphRhythm plots these.
+        """
+        data = []
+        for group in np.split(np.arange(len(self)), self.events()[1:]):
+            row = group[0]
+            rest = self.chord_size[row] == 0
+            data.append({'start_time_s': float(self.start_s[row]), 'end_time_s': float(self.end_s[row]),
+                         'note': ['Rest'] if rest else [str(self.names[i]) for i in group],
+                         'frequency': None if rest else [float(self.frequency[i]) for i in group]})
+        return data
+
+    def measure_rows(self, first, last):
+        """Boolean row mask of measures first..last (inclusive)."""
+        return (self.measure >= first) & (self.measure <= last)
+
+    def measures(self):
+        """(number, start in beats) of each measure, for PagedScoreRenderer."""
+        return list(zip(self.measure_numbers.tolist(), self.measure_starts.tolist()))
+
+    def measure_start(self, number):
+        """Start of a measure in beats (0 if the score has no such measure)."""
+        k = np.flatnonzero(self.measure_numbers == number)
+        return float(self.measure_starts[k[0]]) if len(k) else 0.0
+
+    def to_stream(self, first=None, last=None, pitch=None):
+        """
+        A plain music21 Stream of measures first..last (all by default) with
+        the score's tempo, offsets counted from the first measure. Enough to
+        play or write as MIDI without parsing the file. It has no notation
+        (clefs, beams, ...), so render the parsed score instead.
+
+        Args:
+            pitch (str, optional): play every note at this pitch, e.g. 'C4'
+                for a rhythm-only excerpt.
+        """
+        from music21 import chord, note, stream, tempo
+        rows = np.ones(len(self), bool) if first is None else self.measure_rows(first, last)
+        origin = self.measure_start(first) if first is not None else 0.0
+        excerpt = stream.Stream()
+        excerpt.insert(0, tempo.MetronomeMark(number=self.bpm))
+        for group in np.split(np.flatnonzero(rows), np.flatnonzero(np.diff(self.event[rows])) + 1):
+            if not len(group):
+                continue
+            row = group[0]
+            length = float(self.end_beats[row] - self.start_beats[row])
+            if self.chord_size[row] == 0:
+                element = note.Rest(quarterLength=length)
+            elif pitch is not None:
+                element = note.Note(pitch, quarterLength=length)
+            elif len(group) == 1:
+                element = note.Note(int(self.midi[row]), quarterLength=length)
+            else:
+                element = chord.Chord([int(self.midi[i]) for i in group], quarterLength=length)
+            excerpt.insert(float(self.start_beats[row]) - origin, element)
+        return excerpt
+
+
+def compile_stream(score, source_hash='', default_bpm=60):
+    """Walks a music21 score once and returns its CompiledScore."""
+    columns = {name: [] for name in ROW_COLUMNS}
+    n_notes = n_rests = 0
+    for event, element in enumerate(score.flatten().notesAndRests):
+        start = float(element.offset)
+        end = start + float(element.quarterLength)
+        measure = element.measureNumber or 0
+        if element.isRest:
+            members = [(np.nan, np.nan, 'Rest')]
+            element_id = f"r{n_rests}"
+            n_rests += 1
+        else:
+            members = [(p.midi, p.frequency, p.nameWithOctave) for p in element.pitches]
+            element_id = f"n{n_notes}"
+            n_notes += 1
+        for midi, frequency, name in members:
+            for column, value in zip(ROW_COLUMNS, (start, end, midi, frequency, measure, event,
+                                                   0 if element.isRest else len(members), element_id, name)):
+                columns[column].append(value)
+    dtypes = {'start_beats': float, 'end_beats': float, 'midi': float, 'frequency': float,
+              'measure': np.int32, 'event': np.int32, 'chord_size': np.int16, 'ids': str, 'names': str}
+    columns = {name: np.array(values, dtype=dtypes[name]) for name, values in columns.items()}
+
+    part = score.parts[0] if hasattr(score, 'parts') and len(score.parts) else score
+    measures = [(m.number, float(m.offset)) for m in part.getElementsByClass('Measure')]
+    marks = list(score.recurse().getElementsByClass('MetronomeMark'))
+    return CompiledScore(columns, np.array([n for n, _ in measures], dtype=np.int32),
+                         np.array([offset for _, offset in measures], dtype=float),
+                         marks[0].number if marks and marks[0].number else np.nan,
+                         default_bpm=default_bpm, source_hash=source_hash)
+
+
+def compiled_path(score_path, content_hash):
+    directory, name = os.path.split(os.path.abspath(score_path))
+    return os.path.join(directory, f".{name}.{content_hash[:16]}.npz")
+
+
+def load_score(score_path, default_bpm=60):
+    """
+    CompiledScore of a score file: from the cache if the file's content was
+    compiled before, else parsed with music21 once and cached.
+
+    Raises:
+        OSError: if the file can't be read; music21's errors if it can't be parsed.
+    """
+    content_hash = score_content_hash(score_path)
+    candidates = [compiled_path(score_path, content_hash),
+                  os.path.join(FALLBACK_CACHE_DIR, content_hash + '.npz')]
+    for path in candidates:
+        compiled = CompiledScore.load(path, default_bpm)
+        if compiled is not None and compiled.source_hash == content_hash:
+            return compiled
+
+    from music21 import converter
+    compiled = compile_stream(converter.parse(score_path), content_hash, default_bpm)
+    for path in candidates:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compiled.save(path)
+        except OSError:
+            continue  # read-only folder: try the user cache
+        # older compilations of an edited score are stale now
+        for stale in glob.glob(compiled_path(score_path, '*')):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        break
+    return compiled
@@ -0,0 +1,329 @@
+"""
+In-memory score rendering: music21 -> MusicXML -> verovio SVG -> PNG bytes.
+
+Nothing touches the filesystem or spawns a process, so several viewers can
+run side by side. PNG bytes load straight into either front-end:
+    Qt:      pixmap = QPixmap(); pixmap.loadFromData(png, "PNG")
+    pygame:  pygame.image.load(BytesIO(png))
+
+PagedScoreRenderer lays a whole piece out in measure chunks and prefetches
+the pages ahead of the playhead on its own thread.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cairosvg
+import verovio
+from music21.musicxml.m21ToXml import GeneralObjectExporter
+
+# opening tag of a note group in verovio's SVG output
+NOTE_TAG = re.compile(r'<g id="([^"]+)" class="note"')
+SVG_SIZE = re.compile(r'<svg width="([\d.]+)px" height="([\d.]+)px"')
+
+
+def content_hash(data):
+    """sha256 hex digest of a str or bytes."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return content_hash(f.read())
+
+
+def measure_range(stream):
+    """(first, last) measure number in a music21 stream, None if it has no measures."""
+    numbers = [m.number for m in stream.recurse().getElementsByClass('Measure')]
+    return (min(numbers), max(numbers)) if numbers else None
+
+
+def score_bpm(stream, default_bpm=60):
+    """Tempo of the first metronome mark, like CompiledScore.bpm."""
+    for mark in stream.recurse().getElementsByClass('MetronomeMark'):
+        return mark.number
+    return default_bpm
+
+
+def to_musicxml(stream):
+    return GeneralObjectExporter().parse(stream).decode('utf-8')
+
+
+def rasterize_svg(svg, viewport=None):
+    """
+    Rasterizes an SVG string in memory.
+
+    Args:
+        viewport (tuple, optional): (width, height) in pixels to fit the page
+            into, keeping its aspect ratio; native size if None. Rendering at
+            the final size replaces rasterize-then-smoothscale.
+
+    Returns:
+        bytes: PNG data.
+    """
+    if viewport is None:
+        return cairosvg.svg2png(bytestring=svg.encode('utf-8'))
+    match = SVG_SIZE.search(svg)
+    width, height = float(match.group(1)), float(match.group(2))
+    scale = min(viewport[0] / width, viewport[1] / height)
+    return cairosvg.svg2png(bytestring=svg.encode('utf-8'),
+                            output_width=int(width * scale), output_height=int(height * scale))
+
+
+class RasterCache:
+    """Least-recently-used map of rendered pages, at most `max_pages` entries."""
+
+    def __init__(self, max_pages=16):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, key, page):
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+
+class ScoreRenderer:
+    """
+    verovio layout plus in-memory rasterization, with an LRU cache of pages
+    keyed by (score hash, measure range, scale, viewport).
+
+    The score hash is whatever identifies the content cheaply: file_hash() of
+    the source file when there is one, else content_hash() of the MusicXML.
+    """
+
+    def __init__(self, scale=40, max_pages=16):
+        self.scale = scale
+        self.toolkit = verovio.toolkit()
+        self.toolkit.setOptions({"scale": scale, "adjustPageHeight": True})
+        self.cache = RasterCache(max_pages)
+
+    def to_svg(self, musicxml, page=1):
+        self.toolkit.loadData(musicxml)
+        if self.toolkit.getPageCount() < page:
+            raise ValueError("no pages to render")
+        return self.toolkit.renderToSVG(page)
+
+    def render(self, score_hash, measures, musicxml, viewport=None):
+        """
+        PNG bytes of the first page of a score excerpt.
+
+        Args:
+            score_hash (str): content hash of the score (see class docstring).
+            measures (tuple): (first, last) measure of the excerpt.
+            musicxml (str or callable): the excerpt as MusicXML, or a function
+                returning it, so a cache hit skips parsing/exporting entirely.
+            viewport (tuple, optional): (width, height) to fit the page into.
+        """
+        key = (score_hash, measures, self.scale, viewport)
+        png = self.cache.get(key)
+        if png is None:
+            if callable(musicxml):
+                musicxml = musicxml()
+            png = rasterize_svg(self.to_svg(musicxml), viewport)
+            self.cache.put(key, png)
+        return png
+
+
+class RecolorableSvg:
+    """
+    A verovio SVG page, laid out once, whose notes can be recolored by id.
+
+    The SVG is split right after each note's opening tag. recolor() joins the
+    pieces back, adding the same color/fill attributes verovio writes for a
+    colored note, so a status change costs a string join instead of a MusicXML
+    export and a re-layout. Note ids are the music21 element ids (n.id), which
+    the MusicXML exporter passes through to verovio.
+    """
+
+    def __init__(self, svg):
+        self.svg = svg
+        self.ids = []
+        self._parts = []
+        pos = 0
+        for match in NOTE_TAG.finditer(svg):
+            self._parts.append(svg[pos:match.end()])
+            self.ids.append(match.group(1))
+            pos = match.end()
+        self._parts.append(svg[pos:])
+
+    def recolor(self, colors):
+        """
+        Args:
+            colors (dict): note id -> CSS color; notes not in it keep their
+                original color.
+
+        Returns:
+            str: the SVG with those notes colored.
+        """
+        out = [self._parts[0]]
+        for note_id, part in zip(self.ids, self._parts[1:]):
+            color = colors.get(note_id)
+            if color:
+                out.append(f' color="{color}" fill="{color}"')
+            out.append(part)
+        return ''.join(out)
+
+
+class ScorePage:
+    """One laid-out chunk of measures: its SVG (recolorable) and PNG raster."""
+
+    def __init__(self, index, measures, start_s, svg, png):
+        self.index = index
+        self.measures = measures  # (first, last) measure number
+        self.start_s = start_s  # playback time the page starts at
+        self.svg = svg
+        self.png = png
+
+
+class PagedScoreRenderer:
+    """
+    Renders a score `measures_per_page` measures at a time and keeps the
+    pages around the playhead ready, without ever blocking the caller.
+
+    The UI calls follow(t) with the playback time. It maps t to a page through
+    the measure start times (same tempo model as the score timeline: one bpm,
+    offsets in quarter notes) and wakes the prefetch thread. That thread
+    renders the current page first, then `lookahead` pages after it. page(i)
+    only returns what is already rendered, so a page turn never waits on
+    verovio or cairo, and neither do the audio or detection threads. Pages
+    that fall behind the playhead are dropped, but stay in an LRU of recent
+    pages so seeking back is instant. A page whose render fails is not
+    retried while it is current or ahead; error(i) returns the exception and
+    wait_for(i) raises it.
+
+    `score` is a music21 stream, or a function returning one. With the
+    measure table passed in (`measures`, e.g. from a CompiledScore) the
+    layout needs nothing from the score, and a function is only called by
+    the prefetch thread when the first page is drawn, so the parse happens
+    off the caller's thread.
+    """
+
+    def __init__(self, score, bpm, measures_per_page=4, viewport=None, scale=40, lookahead=2,
+                 max_cached_pages=16, measures=None):
+        self._score = score
+        self.viewport = viewport
+        self.lookahead = lookahead
+        if measures is None:
+            part = self.score.parts[0] if len(self.score.parts) else self.score
+            measures = [(m.number, m.offset) for m in part.getElementsByClass('Measure')]
+        measures = [(int(number), float(offset)) for number, offset in measures]
+        chunks = [measures[i:i + measures_per_page] for i in range(0, len(measures), measures_per_page)]
+        self.page_measures = [(chunk[0][0], chunk[-1][0]) for chunk in chunks]
+        self.page_starts = np.array([chunk[0][1] * 60.0 / bpm for chunk in chunks])
+        # the toolkit and the page LRU are only ever used by the prefetch thread
+        self.renderer = ScoreRenderer(scale=scale)
+        self.cache = RasterCache(max_cached_pages)
+
+        self._pages = {}
+        self._errors = {}  # page index -> exception of its failed render
+        self._current = 0
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self.page_measures)
+
+    @property
+    def score(self):
+        """The music21 stream, loaded on first use if a function was given."""
+        if callable(self._score):
+            self._score = self._score()
+        return self._score
+
+    def page_index(self, t):
+        """Index of the page being played at time t (s)."""
+        return max(0, int(np.searchsorted(self.page_starts, t, side='right')) - 1)
+
+    def follow(self, t):
+        """Moves the playhead to time t (s); returns the current page index."""
+        index = self.page_index(t)
+        with self._changed:
+            if index != self._current:
+                self._current = index
+                for stale in [i for i in self._pages if i < index]:
+                    del self._pages[stale]
+                for stale in [i for i in self._errors if i < index]:
+                    del self._errors[stale]
+                self._changed.notify_all()
+        return index
+
+    def page(self, index):
+        """The ScorePage if it is rendered already, else None."""
+        with self._changed:
+            return self._pages.get(index)
+
+    def error(self, index):
+        """The exception the render of page `index` failed with, else None."""
+        with self._changed:
+            return self._errors.get(index)
+
+    def wait_for(self, index, timeout=None):
+        """
+        Blocks until page `index` is rendered (for start-up, not for page turns).
+
+        Raises:
+            Exception: whatever the render of that page failed with.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: index in self._pages or index in self._errors or self._closed,
+                                   timeout)
+            if index in self._errors:
+                raise self._errors[index]
+            return self._pages.get(index)
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def _missing(self):
+        wanted = range(self._current, min(self._current + self.lookahead + 1, len(self)))
+        return next((i for i in wanted if i not in self._pages and i not in self._errors), None)
+
+    def _prefetch_loop(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._closed or self._missing() is not None)
+                if self._closed:
+                    return
+                index = self._missing()
+            page = error = None
+            try:
+                page = self._render(index)
+            except Exception as e:
+                print(f"Error rendering page {index}: {e}")
+                error = e
+            with self._changed:
+                if index >= self._current:
+                    if error is None:
+                        self._pages[index] = page
+                    else:
+                        self._errors[index] = error
+                    self._changed.notify_all()
+
+    def _render(self, index):
+        page = self.cache.get(index)
+        if page is None:
+            first, last = self.page_measures[index]
+            svg = self.renderer.to_svg(to_musicxml(self.score.measures(first, last)))
+            page = ScorePage(index, (first, last), self.page_starts[index], RecolorableSvg(svg),
+                             rasterize_svg(svg, self.viewport))
+            self.cache.put(index, page)
+        return page
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+class ScoreTimeline:
+    """
+    Score events compiled into columns sorted by start time, for per-frame
+    "which note should be sounding now" lookups.
+
+    at(t) bisects the start column, O(log n). For playback, where time only
+    moves forward, a TimelineCursor from cursor() finds the same note in
+    amortized O(1). Each thread that follows the playhead should use its own
+    cursor. Elements (music21 notes, ...) are reachable by id through a dict.
+    So a full concerto costs the same per frame as an 8-bar excerpt.
+
+    Columns:
+        starts, ends    seconds (float arrays)
+        pitches         MIDI numbers (float array, NaN for rests)
+        ids             event ids (list of str)
+        names           display labels, e.g. 'A4' or ['C4', 'E4'] (list)
+    """
+
+    def __init__(self, starts, ends, pitches, ids, names=None, elements=None):
+        order = np.argsort(np.asarray(starts, dtype=float), kind='stable')
+        self.starts = np.asarray(starts, dtype=float)[order]
+        self.ends = np.asarray(ends, dtype=float)[order]
+        self.pitches = np.asarray(pitches, dtype=float)[order]
+        self.ids = [ids[i] for i in order]
+        self.names = [names[i] for i in order] if names is not None else list(self.ids)
+        # latest end among events [0, i]; lets at() stop walking back early
+        self._reach = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+        self.index = {event_id: i for i, event_id in enumerate(self.ids)}
+        self.elements = {}
+        if elements is not None:
+            self.elements = {self.ids[i]: elements[j] for i, j in enumerate(order)}
+
+    @classmethod
+    def from_score_data(cls, score_data):
+        """
+        Builds the timeline from CompiledScore.score_data() output (detection.py).
+
+        Events are identified by their position in score_data ('e0', 'e1', ...);
+        names are the event's 'note' list and pitches the MIDI number of its
+        first frequency.
+        """
+        pitches = [69 + 12 * np.log2(event['frequency'][0] / 440.0) if event['frequency'] else np.nan
+                   for event in score_data]
+        return cls([event['start_time_s'] for event in score_data],
+                   [event['end_time_s'] for event in score_data],
+                   pitches,
+                   [f"e{i}" for i in range(len(score_data))],
+                   names=[event['note'] for event in score_data])
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def end_time(self):
+        return float(self._reach[-1]) if len(self) else 0.0
+
+    def _active(self, last_started, t):
+        """Index of the latest-starting event with start <= t <= end, -1 if none."""
+        i = last_started
+        # monophonic scores stop at the first step; overlaps walk back only
+        # while some earlier event can still be sounding
+        while i >= 0 and self.ends[i] < t:
+            if self._reach[i] < t:
+                return -1
+            i -= 1
+        return i
+
+    def at(self, t):
+        """Index of the event sounding at time t (s), -1 if none (O(log n))."""
+        return self._active(int(np.searchsorted(self.starts, t, side='right')) - 1, t)
+
+    def cursor(self):
+        return TimelineCursor(self)
+
+
+class TimelineCursor:
+    """
+    Playhead over a ScoreTimeline, amortized O(1) while time moves forward.
+
+    Seeking backwards or jumping far ahead falls back to a bisect.
+    """
+
+    max_steps = 8
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.position = -1  # last event with start <= the previous query time
+
+    def at(self, t):
+        """Same result as ScoreTimeline.at(t)."""
+        starts = self.timeline.starts
+        i = self.position
+        if i >= 0 and starts[i] > t:
+            i = int(np.searchsorted(starts, t, side='right')) - 1
+        else:
+            steps = 0
+            while i + 1 < len(starts) and starts[i + 1] <= t:
+                i += 1
+                steps += 1
+                if steps == self.max_steps:
+                    i = int(np.searchsorted(starts, t, side='right')) - 1
+                    break
+        self.position = i
+        return self.timeline._active(i, t)
@@ -1,44 +1,63 @@
-
-
 from PyQt5.QtWidgets import QLabel
 from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import QTimer
 
-from music21.musicxml.m21ToXml import GeneralObjectExporter
-from music21 import converter
-import verovio
-import cairosvg
+from score_render import PagedScoreRenderer, score_bpm
 
 
 class ScoreViewer(QLabel):
-    def __init__(self, stream):
+    def __init__(self, stream, bpm=None, measures=None):
         super().__init__()
         self.stream = stream
-        self.chunk_size = 4
-        
+        self.chunk_size = 4 # measures per page
+        self.pages = None
+        self.shown_page = None
+        self.playhead_s = 0.0 # set by the detection thread through set_playhead()
+
+        # page turns are applied on the GUI thread; rendering happens in the pages' prefetch thread
+        self.timer = QTimer(self)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.refresh)
+
         self.setText("Test")
-        self.open_file(stream)
+        self.open_file(stream, bpm, measures)
     
-    # open file and display the first 4 measures with verovio
-    def open_file(self, stream):
+    # lay the score out in pages of chunk_size measures, rendered ahead of the playhead
+    # stream may be a function returning it; with bpm and measures (from a CompiledScore)
+    # it is then parsed on the render thread and the first page shows up when it's ready
+    def open_file(self, stream, bpm=None, measures=None):
+        if self.pages is not None:
+            self.pages.close()
         try:
-            
-            vrv_toolkit = verovio.toolkit()
-            exporter = GeneralObjectExporter()
-            xml_data = exporter.parse(stream).decode("utf-8")
-            vrv_toolkit.loadData(xml_data)
-            vrv_toolkit.setOptions({"scale": 40, "adjustPageHeight": True})
-            if vrv_toolkit.getPageCount() < 1:
-                raise ValueError("no pages to render")
-            svg_data = vrv_toolkit.renderToSVG(1)
-            
-            svg_filepath = "temp_excerpt.svg"
-            with open(svg_filepath, "w") as f:
-                f.write(svg_data)
-            png_filepath = "temp_excerpt.png"
-            cairosvg.svg2png(url=svg_filepath, write_to=png_filepath)
-            pixmap = QPixmap(png_filepath)
-            self.setPixmap(pixmap)
+            self.pages = PagedScoreRenderer(stream, bpm or score_bpm(stream),
+                                            measures_per_page=self.chunk_size, measures=measures)
+            self.shown_page = None
+            self.playhead_s = 0.0
+            if measures is None:
+                self.pages.wait_for(0) # only the first page is waited for
+            else:
+                self.setText("Loading score...")
+            self.refresh()
+            self.timer.start()
         except Exception as e:
             self.setText(f"Error: {e}")
-            
-    
\ No newline at end of file
+
+    def set_playhead(self, t):
+        """Playback time in seconds; safe to call from any thread."""
+        self.playhead_s = t
+
+    def refresh(self):
+        index = self.pages.follow(self.playhead_s)
+        if index == self.shown_page:
+            return
+        page = self.pages.page(index)
+        if page is None:
+            error = self.pages.error(index)
+            if error is not None:
+                self.setText(f"Error: {error}")
+                self.shown_page = index
+            return # not rendered yet: keep showing the previous page
+        pixmap = QPixmap()
+        pixmap.loadFromData(page.png, "PNG")
+        self.setPixmap(pixmap)
+        self.shown_page = index
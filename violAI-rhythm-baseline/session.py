@@ -0,0 +1,298 @@
+"""
+Headless live detection engine, one DetectionSession per player.
+
+A session owns everything a take needs: the band-pass state, the
+RingBuffer, the pitch tracker, the fixed-lag smoother, the score cursor,
+each note's status, the notes played and its latency monitor. Nothing is
+global or tied to a widget, so one process can run many sessions side by
+side. Audio comes from a pluggable source (capture.MicrophoneSource,
+ArraySource, PushSource), and results go to sinks, which are plain
+callables that receive event dicts:
+
+    'pitch'  one per analysed hop (smoothed): time, pitch_hz (NaN when
+             unvoiced), note_name, rms (of the audio the frame covers),
+             expected (timeline index, -1 for none), expected_name, heard_at
+    'note'   a note's first judgement: id, index, correct, missed, time,
+             pitch_hz, heard_at
+    'done'   the analysis clock passed the end of the score
+
+time is the sample clock of the take (s) and heard_at the LatencyMonitor
+clock time at which the frame's audio came in, for end-to-end latency.
+
+Front-ends (Qt, pygame, the server) only turn events into pixels or
+messages. A session either runs its own thread (start()/stop()), or is
+driven by the caller through process(), e.g. from a worker pool. Either
+way, only one thread at a time may call process().
+"""
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+import librosa
+
+from capture import FrameReader
+from latency import LatencyMonitor
+from pitch_estimators import StreamingYin, make_estimator
+from pitch_smoother import FixedLagPitchSmoother, hz_to_midi
+from ring_buffer import RingBuffer
+from stream_filter import StreamingBandpass
+
+
+class QueueSink:
+    """Sink that queues events for another thread (a UI timer, an event loop) to drain()."""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+
+    def __call__(self, event):
+        self.queue.put(event)
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class DetectionSession:
+    """
+    Args:
+        source: a capture source; it calls write() with every block.
+        timeline (ScoreTimeline, optional): score to follow; without one
+            only 'pitch' events are emitted. Rests (NaN pitch) show up as
+            'expected' but are never judged.
+        sinks (list): callables that receive every event.
+        backend (str): 'yin' (incremental StreamingYin) or any
+            pitch_estimators backend ('pyin', 'crepe').
+        estimator (PitchEstimator, optional): backend instance to use instead
+            of building one. Pass the same instance to every session, so a
+            process loads one crepe model and not one per session.
+        window_s, hop_s (float): analysis window and hop; each hop is one
+            frame for the smoother.
+        max_batch (int): most hops analysed in one estimator call when the
+            analysis is behind.
+        max_lag_s (float, optional): backlog beyond which stale hops are
+            skipped; None analyses every hop still in the buffer.
+        bandpass (tuple, optional): (lowcut, highcut) in Hz for the streaming
+            band-pass, None to analyse the audio as it comes.
+        amplitude_threshold (float, optional): windows whose peak stays below
+            it count as unvoiced without running the estimator (not for 'yin').
+        smoothing_latency (float): latency budget of the pitch smoother (s).
+        slo_ms (dict, optional): latency limits, see LatencyMonitor.
+        buffer (RingBuffer, optional): ring to analyse instead of a private
+            one, e.g. a SharedRingBuffer filled by another process (which
+            then also does the band-pass).
+    """
+
+    def __init__(self, source, timeline=None, sinks=(), samplerate=44100, backend='yin', estimator=None,
+                 window_s=0.05, hop_s=0.01, max_batch=10, max_lag_s=0.1, bandpass=(180.0, 3000.0),
+                 amplitude_threshold=None, smoothing_latency=0.08, fmin=180.0, fmax=3000.0,
+                 buffer_seconds=2.0, slo_ms=None, buffer=None):
+        self.source = source
+        self.timeline = timeline
+        self.sinks = list(sinks)
+        self.samplerate = samplerate
+        self.window = int(samplerate * window_s)
+        self.hop = max(1, int(samplerate * hop_s))
+        self.max_batch = max_batch
+        self.max_lag = None if max_lag_s is None else int(samplerate * max_lag_s)
+        self.amplitude_threshold = amplitude_threshold
+        self.buffer = buffer if buffer is not None else RingBuffer(int(samplerate * buffer_seconds))
+        self.bandpass = StreamingBandpass(bandpass[0], bandpass[1], samplerate) if bandpass else None
+        if backend == 'yin':
+            # history long enough that a full batch of hops is never skipped
+            self.tracker = StreamingYin(samplerate, fmin=fmin, fmax=fmax, hop_length=self.hop,
+                                        median_frames=max_batch + 1)
+            self.estimator = None
+        else:
+            self.tracker = None
+            self.estimator = estimator or make_estimator(backend, samplerate, fmin=fmin, fmax=fmax,
+                                                         hop_length=int(samplerate * 0.01))
+        # a frame's pitch describes the middle of the audio it covers
+        self._centre = (self.tracker.frame_length if self.tracker is not None else self.window) // 2
+        self.smoother = FixedLagPitchSmoother(fmin, fmax, hop_s=self.hop / samplerate,
+                                              latency_s=smoothing_latency)
+        self.latency = LatencyMonitor(slo_ms=slo_ms)
+        self.running = False
+        self._thread = None
+        self.reset()
+
+    def reset(self):
+        """Starts a new take at the current buffer position (t = 0 from here)."""
+        self.origin = self.buffer.written
+        # StreamingYin reads the ring itself, so its hops need no window copies
+        self.reader = FrameReader(self.buffer, self.window, self.hop, policy='all', start=self.origin,
+                                  max_lag=self.max_lag, copy=self.tracker is None)
+        if self.bandpass is not None:
+            self.bandpass.reset()
+        if self.tracker is not None:
+            self.tracker.reset(self.origin)
+        self.smoother.reset()
+        self.latency.reset()
+        timeline = self.timeline
+        self.cursor = timeline.cursor() if timeline is not None else None
+        self.status = {event_id: None for event_id in timeline.ids} if timeline is not None else {}
+        # rests (NaN pitch) are shown as expected but never judged, so they can't be missed
+        pitched = np.flatnonzero(np.isfinite(timeline.pitches)) if timeline is not None else []
+        self._end_order = pitched[np.argsort(timeline.ends[pitched], kind='stable')] if timeline is not None else []
+        self._finished = 0  # notes in _end_order already over
+        self._pending = deque()  # (end sample, rms) of the frames inside the smoother's lag
+        self.pitches_played = []
+        self.dropouts = 0
+        self.done = False
+
+    @property
+    def delay(self):
+        """Seconds between audio coming in and its smoothed pitch coming out, beyond compute time."""
+        return self.smoother.delay + self._centre / self.samplerate
+
+    # === Audio in ===
+
+    def write(self, block, overflowed=False, input_latency=None):
+        """Source callback: band-passes one block into the ring buffer."""
+        start = self.latency.now()
+        if overflowed:
+            self.dropouts += 1
+            self.latency.count('dropped_blocks')
+        if input_latency is not None:
+            self.latency.record('capture', input_latency)
+        if self.bandpass is not None:
+            block = self.bandpass.process(block)
+        self.buffer.write(block)
+        self.latency.since('filter', start)
+
+    # === Analysis ===
+
+    def process(self, timeout=None):
+        """
+        Analyses the hops that are ready: waits up to `timeout` for the first
+        one, then takes up to max_batch, and sends their events to the sinks.
+
+        Returns:
+            list: the events emitted (empty when nothing was ready in time).
+        """
+        batch = self.reader.read_batch(self.max_batch, timeout)
+        if not batch:
+            return []
+        started = self.latency.now()
+        self.latency.gauge('queue_depth', self.reader.backlog())
+        self.latency.record('queue', (self.buffer.written - batch[0][0]) / self.samplerate)
+        frames = self._estimate(batch)
+        stage = self.latency.since('pitch', started)
+
+        events = []
+        for end, f0, confidence in frames:
+            frame = self.buffer.window(end, 2 * self._centre)
+            self._pending.append((end, float(np.sqrt(np.mean(np.square(frame))))))
+            smoothed = self.smoother.push(f0, confidence)
+            if smoothed is not None:
+                events.extend(self._match(*self._pending.popleft(), smoothed[1]))
+        self.latency.since('match', stage)
+        for event in events:
+            for sink in self.sinks:
+                sink(event)
+        return events
+
+    def _estimate(self, batch):
+        """(end, f0, confidence) per new frame of a batch of (end, window) hops."""
+        if self.tracker is not None:
+            # StreamingYin reads the buffer itself, one frame per hop
+            ends, f0, confidence = self.tracker.update(self.buffer, batch[-1][0])
+            return list(zip(ends, f0, confidence))
+        loud = [k for k, (_, window) in enumerate(batch)
+                if self.amplitude_threshold is None or np.max(np.abs(window)) >= self.amplitude_threshold]
+        results = self.estimator.estimate_many([batch[k][1] for k in loud]) if loud else []
+        observed = {}
+        for k, (_, f0, confidence) in zip(loud, results):
+            voiced = f0[np.isfinite(f0) & (f0 > 0)]
+            observed[k] = (np.median(voiced) if len(voiced) > 0 else np.nan,
+                           float(np.mean(confidence)) if len(confidence) > 0 else 0.0)
+        # quiet windows count as unvoiced
+        return [(end, *observed.get(k, (np.nan, 0.0))) for k, (end, _) in enumerate(batch)]
+
+    def _match(self, end, rms, pitch_hz):
+        """Events for the smoothed pitch of the frame ending at sample `end`."""
+        t = (end - self._centre - self.origin) / self.samplerate  # sample clock, not wall clock
+        voiced = bool(np.isfinite(pitch_hz))
+        note_name = librosa.hz_to_note(pitch_hz) if voiced else None
+        timeline = self.timeline
+        i = self.cursor.at(t) if timeline is not None else -1
+        heard_at = self.latency.now() - (self.buffer.written - end) / self.samplerate
+        events = [{'type': 'pitch', 'time': t, 'pitch_hz': float(pitch_hz), 'note_name': note_name, 'rms': rms,
+                   'expected': i, 'expected_name': timeline.names[i] if i >= 0 else None,
+                   'heard_at': heard_at}]
+        if voiced:
+            self.pitches_played.append({'note_name': note_name, 'estimated_pitch': round(float(pitch_hz), 2),
+                                        'time': round(t, 2)})
+        if timeline is None:
+            return events
+
+        if voiced and i >= 0 and np.isfinite(timeline.pitches[i]) and self.status[timeline.ids[i]] is None:
+            correct = bool(abs(hz_to_midi(pitch_hz) - timeline.pitches[i]) <= 0.5)
+            self.status[timeline.ids[i]] = correct
+            events.append({'type': 'note', 'id': timeline.ids[i], 'index': i, 'correct': correct,
+                           'missed': False, 'time': t, 'pitch_hz': float(pitch_hz), 'heard_at': heard_at})
+        # notes that ended before t without being heard were missed
+        while self._finished < len(self._end_order) and timeline.ends[self._end_order[self._finished]] < t:
+            j = self._end_order[self._finished]
+            if self.status[timeline.ids[j]] is None:
+                self.status[timeline.ids[j]] = False
+                events.append({'type': 'note', 'id': timeline.ids[j], 'index': int(j), 'correct': False,
+                               'missed': True, 'time': t, 'pitch_hz': np.nan, 'heard_at': heard_at})
+            self._finished += 1
+        if not self.done and t > timeline.end_time:
+            self.done = True
+            events.append({'type': 'done', 'time': t})
+        return events
+
+    def warm_up(self):
+        """
+        Runs the pitch path once on silence, so that first-call setup (librosa's
+        lazy imports, model graphs) doesn't stall the first take long enough
+        to skip its opening hops.
+        """
+        if self.tracker is not None:
+            scratch = RingBuffer(self.tracker.frame_length)
+            scratch.write(np.zeros(self.tracker.frame_length, dtype=np.float32))
+            StreamingYin(self.samplerate, hop_length=self.hop).update(scratch)
+        else:
+            self.estimator.estimate(np.zeros(self.window, dtype=np.float32))
+        librosa.hz_to_note(440.0)
+
+    # === Own thread ===
+
+    def start(self):
+        """Starts a new take: resets, starts the source and the analysis thread."""
+        if self.running:
+            return
+        self.warm_up()
+        self.reset()
+        self.running = True
+        self.source.start(self.write)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                # the timeout only bounds how long stop() waits for this thread
+                self.process(timeout=0.1)
+            except Exception as e:
+                print(f"Pitch detection error: {e}")
+
+    def stop(self):
+        """Stops the analysis thread and the source; safe to call from a sink."""
+        if not self.running:
+            return
+        self.running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.source.stop()
+
+    def close(self):
+        """Stops the take and releases the source."""
+        self.stop()
+        self.source.close()